@@ -0,0 +1,44 @@
+import numpy as np
+from .base_agent import Agent
+from utils.mcp import MCPMessage
+from utils.tracing import tracer
+from sentence_transformers import SentenceTransformer
+
+class EmbeddingAgent(Agent):
+    """
+    Stateless agent that encodes chunk batches for the RetrievalAgent.
+
+    It is only used when configured, typically as a pool of worker processes
+    (see `Coordinator.register_remote_agent`), so encoding runs outside the
+    UI process and scales with the number of cores. Each EMBED_REQUEST is
+    answered with an EMBED_COMPLETE carrying the same payload plus the
+    `embeddings`, which the RetrievalAgent adds to the index. A request
+    carrying a `chunk_ref` is answered with the reference and the embeddings
+    only; the Coordinator re-attaches the rest of the payload.
+    """
+    def __init__(self, coordinator_callback, model_name: str = 'sentence-transformers/all-MiniLM-L6-v2',
+                 encode_batch_size: int = 64):
+        super().__init__("EmbeddingAgent", coordinator_callback)
+        self.model = SentenceTransformer(model_name)
+        self.encode_batch_size = encode_batch_size
+
+    def process_message(self, message: MCPMessage):
+        if message.type == "EMBED_REQUEST":
+            chunks = message.payload["chunks"]
+            embeddings = None
+            if chunks:
+                with tracer.span("encode", message.trace_id, chunks=len(chunks)):
+                    embeddings = np.asarray(
+                        self.model.encode(chunks, batch_size=self.encode_batch_size), dtype="float32"
+                    )
+            payload = {**message.payload, "embeddings": embeddings}
+            if "chunk_ref" in payload:
+                # The Coordinator still holds the chunks under the reference
+                del payload["chunks"]
+            self.send_message(MCPMessage(
+                sender=self.name,
+                receiver="Coordinator",
+                type="EMBED_COMPLETE",
+                trace_id=message.trace_id,
+                payload=payload
+            ))
@@ -1,44 +1,325 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from .base_agent import Agent
 from utils.mcp import MCPMessage
-from utils.document_parser import parse_document
+from utils.parsing_engine import ParsingEngine
+from utils.ingestion_ledger import IngestionLedger, hash_file, hash_chunk
+from utils.tracing import tracer
+from utils.context_packing import chunk_offsets
+from utils.document_parser import iter_csv_row_groups
+from typing import Iterator, Tuple
+import itertools
 import os
+import threading
+import time
+
+class _EmbedBatcher:
+    """
+    Buffers chunks for one ingest and sends them on as bounded EMBED_REQUEST
+    batches, so memory stays flat and early batches become searchable while
+    later files are still being parsed. The last batch carries `final` and the
+    batch count, which the RetrievalAgent uses to signal INGEST_COMPLETE.
+    """
+    def __init__(self, agent: Agent, ingest_id: str, batch_size: int):
+        self.agent = agent
+        self.ingest_id = ingest_id
+        self.batch_size = batch_size
+        self.chunks = []
+        self.metadata = []
+        self.stale_chunks = {}
+        self.batches_sent = 0
+
+    def add(self, chunk: str, metadata: dict):
+        self.chunks.append(chunk)
+        self.metadata.append(metadata)
+        if len(self.chunks) >= self.batch_size:
+            self.flush()
+
+    def add_stale(self, source: str, chunk_hashes):
+        self.stale_chunks.setdefault(source, []).extend(chunk_hashes)
+
+    def discard(self, source: str) -> list:
+        """Drops a source's unsent chunks; returns their hashes."""
+        dropped = [meta["chunk_hash"] for meta in self.metadata if meta["source"] == source]
+        kept = [(c, m) for c, m in zip(self.chunks, self.metadata) if m["source"] != source]
+        self.chunks = [c for c, _ in kept]
+        self.metadata = [m for _, m in kept]
+        return dropped
+
+    def flush(self, final: bool = False):
+        payload = {
+            "chunks": self.chunks,
+            "metadata": self.metadata,
+            "stale_chunks": self.stale_chunks,
+            "ingest_id": self.ingest_id,
+            "batch_index": self.batches_sent,
+        }
+        if final:
+            payload["final"] = True
+            payload["total_batches"] = self.batches_sent + 1
+        self.chunks, self.metadata, self.stale_chunks = [], [], {}
+        self.batches_sent += 1
+        self.agent.send_message(MCPMessage(
+            sender=self.agent.name,
+            receiver="Coordinator",
+            type="EMBED_REQUEST",
+            trace_id=self.ingest_id,
+            payload=payload
+        ))
+
 
 class IngestionAgent(Agent):
     """
     Agent responsible for parsing documents, splitting them into chunks,
     and sending them for embedding.
     """
-    def __init__(self, coordinator_callback):
+    def __init__(self, coordinator_callback, parse_workers: int = None, embed_batch_size: int = 256):
         super().__init__("IngestionAgent", coordinator_callback)
+        self.chunk_size = 1000
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
+            chunk_size=self.chunk_size,
             chunk_overlap=200
         )
+        self.ledger = IngestionLedger()
+        # parse_workers=None uses every core; 0 parses inline on the calling thread
+        self.parser = ParsingEngine(max_workers=parse_workers)
+        self.embed_batch_size = embed_batch_size
+        # Ingests and deletes the RetrievalAgent has not finished yet, by trace_id,
+        # with the files they cover and (ingests) the files whose chunks they
+        # changed. A request for one of those files waits in `_waiting`, in
+        # order, so each file's batches and deletes are applied in request order
+        # however many workers the RetrievalAgent runs.
+        self._open = {}
+        self._waiting = []
+        self._open_lock = threading.Lock()
+
+    def shutdown(self):
+        """Stops the parser process pool."""
+        self.parser.shutdown()
+
+    def _page_chunks(self, pages: Iterator[str], timings: dict) -> Iterator[Tuple[str, dict]]:
+        """
+        Splits pages as the parser pool hands them back. Each chunk's page and
+        character offsets let retrieval merge overlapping hits.
+        """
+        waited_from = time.perf_counter()
+        for page_number, page in enumerate(pages):
+            split_start = time.perf_counter()
+            timings["parse"] += split_start - waited_from
+            page_chunks = self.text_splitter.split_text(page)
+            offsets = chunk_offsets(page, page_chunks)
+            timings["split"] += time.perf_counter() - split_start
+            for chunk, start in zip(page_chunks, offsets):
+                yield chunk, {"page": page_number, "start": start, "end": start + len(chunk) if start >= 0 else -1}
+            waited_from = time.perf_counter()
+
+    def _row_chunks(self, path: str, timings: dict) -> Iterator[Tuple[str, dict]]:
+        """
+        Streams a CSV file as chunks of whole rows under a repeated header, with
+        their row range, so memory does not grow with the file.
+        """
+        waited_from = time.perf_counter()
+        for text, first_row, last_row in iter_csv_row_groups(path, self.chunk_size):
+            timings["parse"] += time.perf_counter() - waited_from
+            yield text, {"first_row": first_row, "last_row": last_row}
+            waited_from = time.perf_counter()
+
+    @staticmethod
+    def _sources_of(message: MCPMessage) -> set:
+        if message.type == "INGEST_REQUEST":
+            return {os.path.basename(path) for path in message.payload["file_paths"]}
+        return set(message.payload["sources"])
+
+    def _admit(self, message: MCPMessage) -> bool:
+        """Opens the request, or holds it while an earlier one for any of its files is open or waiting."""
+        sources = self._sources_of(message)
+        with self._open_lock:
+            held = (any(sources & op["sources"] for op in self._open.values())
+                    or any(sources & self._sources_of(waiting) for waiting in self._waiting))
+            if held:
+                self._waiting.append(message)
+            else:
+                self._open[message.trace_id] = {"sources": sources, "touched": []}
+        if held:
+            print(f"[{self.name}] Holding {message.type} for {', '.join(sorted(sources))} "
+                  f"until earlier requests for those files are done.")
+        return not held
+
+    def _close(self, trace_id: str):
+        """Closes a finished request and starts the waiting ones it was holding up."""
+        with self._open_lock:
+            self._open.pop(trace_id, None)
+            released, blocked = [], set()
+            for waiting in list(self._waiting):
+                sources = self._sources_of(waiting)
+                if sources & blocked or any(sources & op["sources"] for op in self._open.values()):
+                    blocked |= sources
+                    continue
+                self._waiting.remove(waiting)
+                self._open[waiting.trace_id] = {"sources": sources, "touched": []}
+                released.append(waiting)
+        for waiting in released:
+            self._start(waiting)
 
     def process_message(self, message: MCPMessage):
+        if message.type in ("INGEST_REQUEST", "DELETE_REQUEST"):
+            if self._admit(message):
+                self._start(message)
+
+        elif message.type == "INGEST_COMPLETE":
+            ingest_id = message.payload.get("ingest_id") or message.trace_id
+            dropped = self.ledger.commit(ingest_id)
+            if dropped:
+                print(f"[{self.name}] Forgot {', '.join(dropped)}: their content was only indexed under a file "
+                      f"that has changed since. Upload them again to index them.")
+            self._close(ingest_id)
+
+        elif message.type == "INGEST_FAILED":
+            ingest_id = message.payload.get("ingest_id") or message.trace_id
+            with self._open_lock:
+                ingest = self._open.get(ingest_id)
+                if ingest is None or ingest.get("failed"):
+                    return
+                # Still streaming (e.g. on another worker) means it must not stage its records
+                ingest["failed"] = True
+                self.ledger.abort(ingest_id)
+                touched = list(ingest["touched"])
+            if not touched:
+                self._close(ingest_id)
+                return
+            # Part of the ingest may already be stored; remove the files outright, so they
+            # are consistent again and ingested in full when re-uploaded. The ingest stays
+            # open, holding up later requests for the files, until the delete is done.
+            print(f"[{self.name}] Ingest failed ({message.payload.get('error')}); "
+                  f"removing {', '.join(touched)}; upload again to retry.")
+            try:
+                self._delete(touched, ingest_id)
+            except Exception:
+                self._close(ingest_id)
+                raise
+
+        elif message.type == "DELETE_COMPLETE":
+            self._close(message.trace_id)
+
+    def _start(self, message: MCPMessage):
         if message.type == "INGEST_REQUEST":
-            print(f"[{self.name}] Received INGEST_REQUEST.")
-            file_paths = message.payload["file_paths"]
-            all_chunks = []
-            all_metadata = []
-
-            for path in file_paths:
-                try:
-                    content = parse_document(path)
-                    chunks = self.text_splitter.split_text(content)
-                    metadata = [{"source": os.path.basename(path)} for _ in chunks]
-                    all_chunks.extend(chunks)
-                    all_metadata.extend(metadata)
-                    print(f"[{self.name}] Parsed and chunked {os.path.basename(path)}.")
-                except Exception as e:
-                    print(f"[{self.name}] Error parsing {path}: {e}")
-
-            if all_chunks:
-                response_msg = MCPMessage(
+            try:
+                self._ingest(message)
+            except Exception as e:
+                # Some batches may be out already; the RetrievalAgent drops the rest
+                # and hands the failure back, which removes the files (see INGEST_FAILED)
+                print(f"[{self.name}] Ingest failed: {e}")
+                self.send_message(MCPMessage(
                     sender=self.name,
                     receiver="Coordinator",
-                    type="EMBED_REQUEST",
-                    payload={"chunks": all_chunks, "metadata": all_metadata}
-                )
-                self.send_message(response_msg)
\ No newline at end of file
+                    type="INGEST_FAILED",
+                    trace_id=message.trace_id,
+                    payload={"ingest_id": message.trace_id, "error": f"{self.name} failed on INGEST_REQUEST: {e}"}
+                ))
+            return
+        sources = message.payload["sources"]
+        print(f"[{self.name}] Received DELETE_REQUEST for {', '.join(sources)}.")
+        try:
+            self._delete(sources, message.trace_id)
+        except Exception:
+            self._close(message.trace_id)
+            raise
+
+    def _ingest(self, message: MCPMessage):
+        print(f"[{self.name}] Received INGEST_REQUEST.")
+        file_paths = message.payload["file_paths"]
+        batcher = _EmbedBatcher(self, message.trace_id, self.embed_batch_size)
+        ledger_updates = []
+        touched = self._open[message.trace_id]["touched"]
+
+        # Hash first (cheap) so unchanged files never reach the parser pool
+        to_parse = []
+        for path in file_paths:
+            source = os.path.basename(path)
+            try:
+                with tracer.span("hash", message.trace_id, source=source):
+                    file_hash = hash_file(path)
+            except Exception as e:
+                print(f"[{self.name}] Error parsing {path}: {e}")
+                continue
+            holders = self.ledger.sources_with_content(file_hash)
+            if holders:
+                if source not in holders:
+                    # Same bytes under a new name: remember the alias, embed nothing,
+                    # and drop whatever an older file with this name contributed
+                    previous = self.ledger.chunk_hashes(source)
+                    if previous:
+                        batcher.add_stale(source, previous)
+                        touched.append(source)
+                    ledger_updates.append((source, file_hash, []))
+                print(f"[{self.name}] Skipped {source}: content already ingested as {', '.join(holders)}.")
+                continue
+            to_parse.append((path, file_hash))
+
+        file_hashes = dict(to_parse)
+        # CSV files are streamed here in row groups rather than parsed whole by the pool
+        streamed = [path for path, _ in to_parse if path.lower().endswith(".csv")]
+        pooled = [path for path, _ in to_parse if not path.lower().endswith(".csv")]
+        files = itertools.chain(self.parser.parse(pooled), ((path, None) for path in streamed))
+        for path, pages in files:
+            source = os.path.basename(path)
+            file_hash = file_hashes[path]
+            # Batches may carry its chunks from the first one on
+            touched.append(source)
+            known = set(self.ledger.chunk_hashes(source))
+            chunk_hashes = []
+            sent = set()
+            timings = {"parse": 0.0, "split": 0.0}
+            chunks = self._row_chunks(path, timings) if pages is None else self._page_chunks(pages, timings)
+            try:
+                # Only forward chunks the previous version of this file did not have
+                for chunk, location in chunks:
+                    chunk_hash = hash_chunk(chunk)
+                    chunk_hashes.append(chunk_hash)
+                    if chunk_hash in known or chunk_hash in sent:
+                        continue
+                    sent.add(chunk_hash)
+                    batcher.add(chunk, {"source": source, "chunk_hash": chunk_hash, "file_hash": file_hash, **location})
+                tracer.record("parse", timings["parse"], message.trace_id, source=source)
+                tracer.record("split", timings["split"], message.trace_id, source=source, chunks=len(chunk_hashes))
+            except Exception as e:
+                print(f"[{self.name}] Error parsing {path}: {e}")
+                # Batches already sent for this file are withdrawn so it is all-or-nothing
+                withdrawn = sent - set(batcher.discard(source))
+                if withdrawn:
+                    batcher.add_stale(source, sorted(withdrawn))
+                continue
+
+            stale = known - set(chunk_hashes)
+            if stale:
+                batcher.add_stale(source, sorted(stale))
+            ledger_updates.append((source, file_hash, chunk_hashes))
+            print(f"[{self.name}] Parsed and chunked {source}: {len(sent)} new, "
+                  f"{len(chunk_hashes) - len(sent)} unchanged or repeated, {len(stale)} stale chunks.")
+
+        # Recorded in the ledger only once the RetrievalAgent has stored every batch
+        with self._open_lock:
+            if not self._open.get(message.trace_id, {"failed": True}).get("failed"):
+                self.ledger.stage(message.trace_id, ledger_updates)
+        # Always send a final batch, even an empty one, so the UI leaves its processing state
+        batcher.flush(final=True)
+
+    def _delete(self, sources: list, trace_id: str):
+        """
+        Forgets the files first so a re-upload is ingested again, then has the
+        RetrievalAgent drop their chunks (sources unknown to the ledger too).
+        The request `trace_id` stays open until DELETE_COMPLETE.
+        """
+        forgotten = self.ledger.forget(sources)
+        aliases = [source for source in forgotten if source not in sources]
+        if aliases:
+            print(f"[{self.name}] Also removing {', '.join(aliases)}: their content was only indexed under a deleted file.")
+            with self._open_lock:
+                if trace_id in self._open:
+                    self._open[trace_id]["sources"].update(aliases)
+        self.send_message(MCPMessage(
+            sender=self.name,
+            receiver="Coordinator",
+            type="DELETE_REQUEST",
+            trace_id=trace_id,
+            payload={"sources": list(sources) + aliases}
+        ))
@@ -1,21 +1,34 @@
-import os
-import google.generativeai as genai
+import time
 from .base_agent import Agent
 from utils.mcp import MCPMessage
+from utils.tracing import tracer
+from utils.llm_providers import LLMProvider, GeminiProvider
+from utils.llm_scheduler import LLMScheduler
+from utils.cache import SemanticAnswerCache
 
 class LLMResponseAgent(Agent):
     """
     Agent responsible for generating a final, user-facing answer by
     calling the Gemini LLM with the user's query and the retrieved context.
+
+    With `stream=True` the answer is forwarded piece by piece as
+    GENERATE_PARTIAL messages while it is generated; the closing
+    GENERATE_RESPONSE still carries the full answer and the sources.
+
+    Answers are served from a semantic cache when a near-identical question
+    retrieved exactly the same chunks; pass `answer_cache=False` to disable it.
+
+    Model calls go through an LLMScheduler (concurrency cap, coalescing of
+    identical prompts, retries, deadlines), configured from the environment
+    unless `scheduler` is given.
     """
-    def __init__(self, coordinator_callback):
+    def __init__(self, coordinator_callback, provider: LLMProvider = None, stream: bool = True,
+                 answer_cache: SemanticAnswerCache = None, scheduler: LLMScheduler = None):
         super().__init__("LLMResponseAgent", coordinator_callback)
-        try:
-            genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
-        except Exception as e:
-            raise Exception("GOOGLE_API_KEY not found. Please set it in your .env file.") from e
-        
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.provider = provider or GeminiProvider()
+        self.scheduler = scheduler or LLMScheduler.from_env(self.provider)
+        self.stream = stream
+        self.answer_cache = SemanticAnswerCache() if answer_cache is None else (answer_cache or None)
 
     def process_message(self, message: MCPMessage):
         if message.type == "GENERATE_REQUEST":
@@ -27,16 +40,31 @@ class LLMResponseAgent(Agent):
                 context_chunks = message.payload.get("retrieved_context", [])
             trace_id = message.payload.get("trace_id")
 
+            query_embedding = message.payload.get("query_embedding")
+            chunk_hashes = message.payload.get("chunk_hashes") or []
+            use_cache = self.answer_cache is not None and query_embedding is not None and len(chunk_hashes) >= len(context_chunks)
+            cached = self.answer_cache.lookup(query_embedding, chunk_hashes) if use_cache and context_chunks else None
+
             if not context_chunks:
                 answer = "I'm sorry, I couldn't find any relevant information in the uploaded documents to answer your question."
                 sources = []
+            elif cached is not None:
+                print(f"[{self.name}] Serving answer from semantic cache.")
+                answer = cached["answer"]
+                sources = cached["sources"]
             else:
-                prompt = self._create_prompt(query, context_chunks)
+                with tracer.span("prompt_build", message.trace_id, chunks=len(context_chunks)):
+                    prompt = self._create_prompt(query, context_chunks)
                 #print(f"[LLMResponseAgent] Prompt sent to LLM:\n{prompt}")
                 try:
-                    response = self.model.generate_content(prompt)
-                    answer = response.text
+                    with tracer.span("llm_call", message.trace_id, prompt_chars=len(prompt)):
+                        if self.stream:
+                            answer = self._stream_answer(prompt, message.trace_id)
+                        else:
+                            answer = self.scheduler.generate(prompt)
                     sources = context_chunks
+                    if use_cache:
+                        self.answer_cache.store(query_embedding, chunk_hashes, answer, sources)
                 except Exception as e:
                     answer = f"An error occurred while contacting the Gemini API: {e}"
                     sources = []
@@ -45,10 +73,36 @@ class LLMResponseAgent(Agent):
                 sender=self.name,
                 receiver="Coordinator",
                 type="GENERATE_RESPONSE",
+                trace_id=message.trace_id,
                 payload={"answer": answer, "sources": sources, "trace_id": trace_id}
             )
             self.send_message(response_msg)
-            
+
+        elif message.type == "CACHE_INVALIDATE":
+            self._invalidate_cache(message)
+
+    def _invalidate_cache(self, message: MCPMessage):
+        if self.answer_cache is not None:
+            removed = self.answer_cache.invalidate_chunks(message.payload.get("chunk_hashes", []))
+            if removed:
+                print(f"[{self.name}] Invalidated {removed} cached answers.")
+
+    def _stream_answer(self, prompt: str, trace_id: str) -> str:
+        """Forwards each generated piece to the Coordinator and returns the full text."""
+        pieces = []
+        started = time.perf_counter()
+        for delta in self.scheduler.stream(prompt):
+            if not pieces:
+                tracer.record("llm_first_token", time.perf_counter() - started, trace_id)
+            pieces.append(delta)
+            self.send_message(MCPMessage(
+                sender=self.name,
+                receiver="Coordinator",
+                type="GENERATE_PARTIAL",
+                trace_id=trace_id,
+                payload={"delta": delta, "trace_id": trace_id}
+            ))
+        return "".join(pieces)
 
     def _create_prompt(self, query: str, context_chunks: list[str]) -> str:
         context_str = "\n\n---\n\n".join(context_chunks)
@@ -2,8 +2,20 @@ import faiss
 import numpy as np
 import google.generativeai as genai
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .base_agent import Agent
 from utils.mcp import MCPMessage
+from utils.vector_store import SegmentStore
+from utils.index_policy import IndexPolicy, reconstruct_all, is_compressed, describe_index
+from utils.tracing import tracer
+from utils.cache import LRUCache
+from utils.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from utils.chunk_store import ChunkTable
+from utils.rwlock import RWLock
+from utils.ingestion_ledger import hash_chunk
+from utils.context_packing import pack_context, estimate_tokens
 from sentence_transformers import SentenceTransformer
 
 class RetrievalAgent(Agent):
@@ -11,8 +23,11 @@ class RetrievalAgent(Agent):
     Agent responsible for creating and storing vector embeddings (using Gemini & FAISS)
     and retrieving relevant document chunks based on a user query.
     """
-    def __init__(self, coordinator_callback):
-        import pickle
+    def __init__(self, coordinator_callback, index_policy: IndexPolicy = None, encode_batch_size: int = 64,
+                 query_cache_size: int = 1024, query_cache_ttl: float = 3600,
+                 hybrid_weight: float = None, rrf_k: int = None, hybrid_candidates: int = 20,
+                 tombstone_purge_ratio: float = None, context_candidates: int = None,
+                 context_token_budget: int = None, model=None):
         super().__init__("RetrievalAgent", coordinator_callback)
         try:
             genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
@@ -20,67 +35,601 @@ class RetrievalAgent(Agent):
             raise Exception("GOOGLE_API_KEY not found. Please set it in your .env file.") from e
 
         self.embedding_model_name = 'sentence-transformers/all-MiniLM-L6-v2'
-        self.model = SentenceTransformer(self.embedding_model_name)
+        # `model` replaces the SentenceTransformer, e.g. with a stub for benchmarks;
+        # anything with a compatible `encode` works
+        self.model = model if model is not None else SentenceTransformer(self.embedding_model_name)
+        self.encode_batch_size = encode_batch_size
+        # Query text -> embedding; embeddings do not depend on the corpus, so no invalidation
+        self.query_cache = LRUCache(query_cache_size, query_cache_ttl, name="query_embedding")
         self.index = None
-        self.chunks_with_metadata = []
+        # (chunk, metadata) by index position; backed by memory-mapped store files
+        self.chunks_with_metadata = ChunkTable()
+        # Stable chunk id by index position (ascending); positions change when
+        # tombstoned rows are purged, ids do not
+        self.chunk_ids = np.empty(0, dtype="int64")
+        self.index_policy = index_policy or IndexPolicy.from_env()
+        # Memory-mapped float32 vectors for exact re-ranking; only kept for compressed indexes
+        self.full_vectors = None
+        # Positions of chunks dropped on re-ingestion or deleted; filtered at search
+        # time and purged in the background once they make up this fraction of the index.
+        self.tombstones = set()
+        self.tombstone_purge_ratio = (float(os.environ.get("RAG_TOMBSTONE_PURGE_RATIO", 0.1))
+                                      if tombstone_purge_ratio is None else tombstone_purge_ratio)
+        self._chunk_positions = None
+        self._rebuild_thread = None
+        # Bumped whenever the index is replaced; a background rebuild built from an
+        # older generation is discarded instead of swapped in
+        self._generation = 0
+        # Hybrid retrieval: BM25 keyword hits are fused with vector hits by reciprocal
+        # rank. hybrid_weight is the keyword share (0 = vector only, 1 = keyword only).
+        self.hybrid_weight = float(os.environ.get("RAG_HYBRID_WEIGHT", 0.5)) if hybrid_weight is None else hybrid_weight
+        self.rrf_k = int(os.environ.get("RAG_RRF_K", 60)) if rrf_k is None else rrf_k
+        self.hybrid_candidates = hybrid_candidates
+        self.keyword_index = KeywordIndex()
+        # Context packing: this many hits are fetched, overlapping ones merged into
+        # spans, and spans added by relevance up to the (estimated) token budget
+        self.context_candidates = (int(os.environ.get("RAG_CONTEXT_CANDIDATES", 6))
+                                   if context_candidates is None else context_candidates)
+        self.context_token_budget = (int(os.environ.get("RAG_CONTEXT_TOKEN_BUDGET", 1000))
+                                     if context_token_budget is None else context_token_budget)
+        self._keyword_saved_docs = 0
+        self._keyword_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="keyword-search")
+        # ingest_id -> next batch to apply and out-of-order batches held until then;
+        # a failed ingest's entry only counts the batches still arriving, to drop them
+        self.pending_ingests = {}
+        # The Coordinator may run several workers on this agent, and one agent is
+        # shared by every UI session. Encoding happens outside the lock; searches
+        # share the read side, index/chunk/store updates take the write side.
+        self._lock = RWLock()
 
-        # Persistence paths
+        # Persistence: append-only segments under store_dir. The old single-file
+        # index/pickle pair is imported once if no segment store exists yet.
+        self.store_dir = "faiss_store"
         self.index_path = "faiss_index.bin"
         self.meta_path = "faiss_chunks.pkl"
+        self.store = SegmentStore(
+            self.store_dir,
+            legacy_index_path=self.index_path,
+            legacy_meta_path=self.meta_path
+        )
 
         # Try to load index and metadata
-        if os.path.exists(self.index_path) and os.path.exists(self.meta_path):
-            try:
-                self.index = faiss.read_index(self.index_path)
-                with open(self.meta_path, "rb") as f:
-                    self.chunks_with_metadata = pickle.load(f)
+        try:
+            self.index, self.chunks_with_metadata = self.store.load()
+            self.full_vectors = self.store.full_vectors()
+            self.chunk_ids = self.store.chunk_ids()
+            self.tombstones = set(self._positions_of(self.store.tombstones()).tolist())
+            self._index_chunk_positions()
+            self._load_keyword_index()
+            if self.index is not None:
+                self.index_policy.configure_search(self.index)
                 print(f"[RetrievalAgent] Loaded FAISS index and metadata from disk.")
-            except Exception as e:
-                print(f"[RetrievalAgent] Failed to load FAISS index or metadata: {e}")
+                self._maybe_rebuild_index()
+        except Exception as e:
+            print(f"[RetrievalAgent] Failed to load FAISS index or metadata: {e}")
 
     def _initialize_index(self, embedding_dim: int):
         if self.index is None:
             # Gemini 'embedding-001' model has a dimension of 768
             self.index = faiss.IndexFlatL2(embedding_dim)
 
+    def _index_chunk_positions(self):
+        """Drops the source -> chunk_hash map; it is rebuilt on first use."""
+        self._chunk_positions = None
+
+    @property
+    def chunk_positions(self) -> dict:
+        """
+        Maps source -> chunk_hash -> index positions, so the stale chunks of a
+        changed file and all chunks of a deleted one can be found. Chunks stored
+        without a hash are listed under None. Built lazily from the hash columns
+        only, so startup does not scan the corpus.
+        """
+        if self._chunk_positions is None:
+            chunk_positions = {}
+            for pos, (source, chunk_hash) in enumerate(self.chunks_with_metadata.keys()):
+                if pos in self.tombstones:
+                    continue
+                chunk_positions.setdefault(source, {}).setdefault(chunk_hash, []).append(pos)
+            self._chunk_positions = chunk_positions
+        return self._chunk_positions
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self._chunk_id_buffer[:self._chunk_id_count]
+
+    @chunk_ids.setter
+    def chunk_ids(self, chunk_ids: np.ndarray):
+        self._chunk_id_buffer = np.asarray(chunk_ids, dtype="int64")
+        self._chunk_id_count = len(self._chunk_id_buffer)
+
+    def _append_chunk_ids(self, ids: np.ndarray):
+        """
+        Appends into spare capacity, doubling it when full, so a batch costs
+        O(batch) rather than a copy of every id. Arrays already handed out by
+        `chunk_ids` are views of rows that are never rewritten.
+        """
+        count = self._chunk_id_count + len(ids)
+        if count > len(self._chunk_id_buffer):
+            grown = np.empty(max(count, 2 * len(self._chunk_id_buffer)), dtype="int64")
+            grown[:self._chunk_id_count] = self.chunk_ids
+            self._chunk_id_buffer = grown
+        self._chunk_id_buffer[self._chunk_id_count:count] = ids
+        self._chunk_id_count = count
+
+    def _positions_of(self, chunk_ids) -> np.ndarray:
+        """Positions of the given chunk ids; ids that are no longer stored are skipped."""
+        chunk_ids = np.asarray(chunk_ids, dtype="int64")
+        positions = np.searchsorted(self.chunk_ids, chunk_ids)
+        found = positions < len(self.chunk_ids)
+        found[found] = self.chunk_ids[positions[found]] == chunk_ids[found]
+        return positions[found]
+
+    def sources(self) -> list:
+        """Sources that still have chunks in the index, e.g. for a document list in the UI."""
+        with self._lock.read():
+            return sorted(source for source, by_hash in self.chunk_positions.items() if by_hash and source)
+
+    def wait_for_background_work(self, timeout: float = None):
+        """Waits for a running index rebuild and segment compaction to finish, e.g. before shutting down."""
+        rebuild_thread = self._rebuild_thread
+        if rebuild_thread is not None:
+            rebuild_thread.join(timeout)
+        self.store.wait_for_compaction(timeout)
+
+    @property
+    def keyword_index_path(self) -> str:
+        return self.store.sidecar_path("keyword_index.npz")
+
+    def _load_keyword_index(self):
+        """Loads the saved keyword index and indexes any chunks appended after it was saved."""
+        try:
+            keyword_index, epoch = KeywordIndex.load(self.keyword_index_path)
+        except Exception as e:
+            print(f"[{self.name}] Failed to load keyword index, rebuilding it: {e}")
+            keyword_index, epoch = None, None
+        if keyword_index is None or epoch != self.store.epoch() or len(keyword_index) > len(self.chunks_with_metadata):
+            keyword_index = KeywordIndex()
+        self._keyword_saved_docs = len(keyword_index)
+        keyword_index.add(self.chunks_with_metadata.iter_texts(len(keyword_index)))
+        self.keyword_index = keyword_index
+        self._maybe_save_keyword_index()
+
+    def _maybe_save_keyword_index(self, force: bool = False):
+        """
+        Snapshots the keyword index once it has grown by 10% (at least 1000 chunks)
+        since the last save, so saving stays amortized O(1) per chunk. Chunks added
+        after the last save are re-indexed from the segment store on load.
+        """
+        unsaved = len(self.keyword_index) - self._keyword_saved_docs
+        if not force and unsaved < max(1000, 0.1 * self._keyword_saved_docs):
+            return
+        try:
+            with tracer.span("keyword_persist", docs=len(self.keyword_index)):
+                self.keyword_index.save(self.keyword_index_path, self.store.epoch())
+            self._keyword_saved_docs = len(self.keyword_index)
+        except Exception as e:
+            print(f"[{self.name}] Failed to save keyword index: {e}")
+
+    def _vectors(self, start: int = 0) -> np.ndarray:
+        """The index's vectors from position `start` on."""
+        if is_compressed(self.index) and self.full_vectors is not None and len(self.full_vectors) == self.index.ntotal:
+            # The exact vectors, not lossy decoded codes
+            return np.asarray(self.full_vectors[np.arange(start, self.index.ntotal)])
+        return reconstruct_all(self.index, start)
+
+    def _maybe_rebuild_index(self):
+        """
+        Starts a background rebuild when the index policy wants a flat index
+        upgraded, or tombstones exceed `tombstone_purge_ratio`; see
+        `_rebuild_in_background`. Callers hold the write lock.
+        """
+        if self.index is None or (self._rebuild_thread is not None and self._rebuild_thread.is_alive()):
+            return
+        if (self.index_policy.should_upgrade(self.index)
+                or len(self.tombstones) > self.tombstone_purge_ratio * self.index.ntotal):
+            self._rebuild_thread = threading.Thread(target=self._rebuild_in_background,
+                                                    name="index-rebuild", daemon=True)
+            self._rebuild_thread.start()
+
+    def _rebuild_in_background(self):
+        """
+        Rebuilds the index without its tombstoned rows, upgrading a flat index
+        per the index policy in the same pass, while searches and ingests go
+        on. The live state is copied under the read lock, the new index,
+        keyword index and store snapshot are built without any lock, and the
+        write lock is only taken to swap them in along with the rows appended
+        meanwhile. Tombstones set meanwhile are carried over by chunk id, and
+        purged by another pass if they are over the ratio again.
+        """
+        try:
+            while self._rebuild_once():
+                pass
+        except Exception as e:
+            print(f"[{self.name}] Failed to rebuild the index: {e}")
+
+    def _rebuild_once(self) -> bool:
+        """One rebuild pass; returns whether another one is due."""
+        rebuild_start = time.perf_counter()
+        # Pinning holds off store compaction, so the snapshot replaces exactly the copied rows
+        with self.store.pinned():
+            with self._lock.read():
+                # Copied under the read lock, so no batch can be appended between
+                # the manifest and the rows it must describe
+                pinned = self.store.manifest_copy()
+                generation = self._generation
+                index = self.index
+                count = index.ntotal
+                chunks = ChunkTable(self.chunks_with_metadata.parts)
+                chunk_ids = self.chunk_ids
+                dead = np.fromiter(self.tombstones, dtype="int64", count=len(self.tombstones))
+                upgrade = self.index_policy.should_upgrade(index)
+                vectors = self._vectors()
+            keep = np.setdiff1d(np.arange(count), dead)
+            vectors = vectors[keep]
+            if upgrade and len(vectors) >= self.index_policy.upgrade_threshold:
+                print(f"[{self.name}] Upgrading flat index with {len(vectors)} vectors to {self.index_policy.kind}.")
+                rebuilt = self.index_policy.build_index(vectors)
+            else:
+                rebuilt = self.index_policy.rebuild(index, vectors)
+            keyword_index = None
+            if len(dead):
+                # Positions are renumbered, so the keyword index is rebuilt too
+                keyword_index = KeywordIndex()
+                keyword_index.add(chunks.text(int(i)) for i in keep)
+            base = self.store.write_snapshot(rebuilt, chunks.select(keep), chunk_ids[keep],
+                                             vectors if is_compressed(rebuilt) else None, replaces=pinned)
+
+        with self._lock.write():
+            if generation != self._generation:
+                print(f"[{self.name}] Discarded an index rebuild; the index was replaced meanwhile.")
+                return False
+            if self.index.ntotal > count:
+                rebuilt.add(self._vectors(count))
+            dead_ids = self.chunk_ids[np.fromiter(self.tombstones, dtype="int64", count=len(self.tombstones))]
+            self.index = rebuilt
+            self.chunks_with_metadata = ChunkTable([base] + self.chunks_with_metadata.parts_from(count))
+            self.chunk_ids = np.concatenate([chunk_ids[keep], self.chunk_ids[count:]])
+            self.tombstones = set(self._positions_of(dead_ids).tolist())
+            self.full_vectors = self.store.full_vectors()
+            if keyword_index is not None:
+                keyword_index.add(self.chunks_with_metadata.iter_texts(len(keep)))
+                self.keyword_index = keyword_index
+                self._keyword_saved_docs = 0
+            self._index_chunk_positions()
+            self._generation += 1
+            # A pass that changed neither the index type nor the rows would only repeat itself
+            progressed = len(dead) > 0 or describe_index(rebuilt) != describe_index(index)
+            again = progressed and (self.index_policy.should_upgrade(self.index)
+                                    or len(self.tombstones) > self.tombstone_purge_ratio * self.index.ntotal)
+        if upgrade:
+            tracer.record("index_rebuild", time.perf_counter() - rebuild_start, vectors=len(keep), upgrade=True)
+        if len(dead):
+            tracer.record("tombstone_purge", time.perf_counter() - rebuild_start, purged=len(dead), vectors=len(keep))
+            print(f"[{self.name}] Purged {len(dead)} deleted chunks from the index.")
+        with self._lock.read():
+            # The snapshot bumped the store epoch, which the saved keyword index records
+            self._maybe_save_keyword_index(force=True)
+        return again
+
+    def _tombstone(self, positions: list):
+        """
+        Marks positions deleted; on disk by chunk id, so the marks survive
+        renumbering. If they cannot be saved the error propagates and fails
+        the request, and nothing is marked.
+        """
+        try:
+            self.store.add_tombstones(self.chunk_ids[positions].tolist())
+        except Exception:
+            # Callers already took the positions out of the map; rebuild it on next use
+            self._index_chunk_positions()
+            raise
+        self.tombstones.update(positions)
+
+    def _drop_stale_chunks(self, stale_chunks: dict) -> list:
+        """Tombstones the chunks a changed file no longer contains; returns their hashes."""
+        positions = []
+        dropped_hashes = []
+        for source, chunk_hashes in stale_chunks.items():
+            by_hash = self.chunk_positions.get(source, {})
+            for chunk_hash in chunk_hashes:
+                found = by_hash.pop(chunk_hash, [])
+                if found:
+                    positions.extend(found)
+                    dropped_hashes.append(chunk_hash)
+        if positions:
+            self._tombstone(positions)
+        return dropped_hashes
+
+    def _delete_sources(self, sources: list) -> tuple:
+        """Tombstones every chunk of the given sources; returns the chunk count and their hashes."""
+        positions = []
+        dropped_hashes = []
+        for source in sources:
+            for chunk_hash, found in self.chunk_positions.pop(source, {}).items():
+                positions.extend(found)
+                if chunk_hash is not None:
+                    dropped_hashes.append(chunk_hash)
+        if positions:
+            self._tombstone(positions)
+        return len(positions), dropped_hashes
+
+    def _add_chunks(self, chunks: list, metadata: list, embeddings, trace_id: str = None):
+        embeddings = np.array(embeddings).astype('float32')
+        new_entries = list(zip(chunks, metadata))
+
+        # Persist the batch as a segment first so disk never lags behind memory;
+        # a batch that cannot be persisted fails the ingest and touches nothing.
+        # The chunk table then maps the segment instead of holding the batch.
+        start = len(self.chunks_with_metadata)
+        with tracer.span("persist", trace_id, chunks=len(chunks)):
+            segment, ids = self.store.append(embeddings, new_entries)
+        print(f"[{self.name}] Saved FAISS segment with {len(chunks)} vectors to disk.")
+        self._initialize_index(embeddings.shape[1])
+        self.chunks_with_metadata.add_part(segment)
+        if is_compressed(self.index):
+            self.full_vectors = self.store.full_vectors()
+        self._append_chunk_ids(ids)
+
+        with tracer.span("index_add", trace_id, chunks=len(chunks)):
+            self.index.add(embeddings)
+        with tracer.span("keyword_index_add", trace_id, chunks=len(chunks)):
+            self.keyword_index.add(chunks)
+        self._maybe_save_keyword_index()
+        if self._chunk_positions is not None:
+            for pos, meta in enumerate(metadata, start):
+                self._chunk_positions.setdefault(meta.get("source"), {}).setdefault(
+                    meta.get("chunk_hash"), []).append(pos)
+
+    def _keyword_search(self, query: str, k: int, trace_id: str = None) -> list:
+        with tracer.span("keyword_search", trace_id, docs=len(self.keyword_index), k=k):
+            return [pos for pos, _ in self.keyword_index.search(query, k, exclude=self.tombstones)]
+
+    def _take_ready_batches(self, payload: dict, embeddings) -> tuple:
+        """
+        Returns the batches that can be applied now, in batch order, and whether
+        the ingest is complete once they are. Batches of one ingest can arrive out
+        of order (several workers, or an EmbeddingAgent pool), so each is held
+        until its predecessors are applied; a stale-chunk withdrawal then never
+        overtakes the chunks it withdraws.
+        """
+        ingest_id = payload.get("ingest_id")
+        if ingest_id is None:
+            return [(payload, embeddings)], True
+        progress = self._ingest_progress(ingest_id)
+        progress["seen"].add(payload.get("batch_index", 0))
+        if payload.get("final"):
+            progress["total"] = payload.get("total_batches")
+        if progress["failed"]:
+            self._forget_failed_ingest(ingest_id)
+            return [], False
+        progress["held"][payload.get("batch_index", 0)] = (payload, embeddings)
+        ready = []
+        while progress["next"] in progress["held"]:
+            ready.append(progress["held"].pop(progress["next"]))
+            progress["next"] += 1
+        complete = any(batch.get("final") for batch, _ in ready)
+        if complete:
+            del self.pending_ingests[ingest_id]
+        return ready, complete
+
+    def _ingest_progress(self, ingest_id: str) -> dict:
+        return self.pending_ingests.setdefault(
+            ingest_id, {"next": 0, "held": {}, "seen": set(), "total": None, "failed": False})
+
+    def _fail_ingest(self, ingest_id: str, batch_index: int = None) -> int:
+        """
+        Drops a failed ingest's held batches and any still to come; `batch_index`
+        is the batch that failed, if any. Returns how many batches were held.
+        """
+        progress = self._ingest_progress(ingest_id)
+        if batch_index is not None:
+            progress["seen"].add(batch_index)
+        held = len(progress["held"])
+        progress["held"].clear()
+        progress["failed"] = True
+        self._forget_failed_ingest(ingest_id)
+        return held
+
+    def _forget_failed_ingest(self, ingest_id: str):
+        progress = self.pending_ingests[ingest_id]
+        if progress["total"] is not None and len(progress["seen"]) >= progress["total"]:
+            del self.pending_ingests[ingest_id]
+
+    def _vector_search(self, query_embeddings: np.ndarray, depth: int, trace_id: str = None) -> list:
+        """
+        Live (non-tombstoned) hits for each query row, best first, from one matrix
+        search. Over-fetches so enough hits survive the tombstone filter; with many
+        tombstones it starts small and widens only for the queries still short.
+        Callers hold the read lock.
+        """
+        hits = [[] for _ in range(len(query_embeddings))]
+        max_k = min(depth + len(self.tombstones), self.index.ntotal)
+        fetch_k = min(2 * depth, max_k)
+        pending = np.arange(len(query_embeddings))
+        while len(pending):
+            with tracer.span("search", trace_id, ntotal=self.index.ntotal, k=fetch_k, queries=len(pending)):
+                # Compressed indexes are re-ranked exactly against full_vectors
+                _, indices = self.index_policy.search(
+                    self.index, query_embeddings[pending], fetch_k, self.full_vectors
+                )
+            short = []
+            for row, found in zip(pending, indices):
+                # Approximate indexes pad with -1 when fewer than k neighbours are found
+                hits[row] = [int(i) for i in found if i >= 0 and i not in self.tombstones][:depth]
+                if len(hits[row]) < depth:
+                    short.append(row)
+            if fetch_k >= max_k:
+                break
+            pending = np.array(short, dtype="int64")
+            fetch_k = min(4 * fetch_k, max_k)
+        return hits
+
+    def retrieve(self, queries: list, trace_ids: list = None, trace_id: str = None, k: int = None) -> list:
+        """
+        Retrieves the top `k` chunks (default `context_candidates`) for each
+        query and packs them into at most `context_token_budget` tokens of
+        context, merging hits that overlap in their document. Uncached queries are
+        encoded in one call and searched as one matrix; keyword searches run on
+        the pool meanwhile. Returns one RETRIEVAL_RESPONSE payload per query,
+        in order, each carrying its entry of `trace_ids` (generated if omitted).
+        `trace_id` labels the spans, e.g. the id of a batch request.
+        """
+        if trace_ids is None:
+            import uuid
+            trace_ids = [str(uuid.uuid4()) for _ in queries]
+        if len(trace_ids) != len(queries):
+            raise ValueError("Need one trace id per query.")
+        trace_id = trace_id or (trace_ids[0] if trace_ids else None)
+        k = k or self.context_candidates
+        results = [{"query": query, "retrieved_context": [], "chunk_hashes": [],
+                    "query_embedding": None, "context_tokens": 0, "trace_id": query_trace_id}
+                   for query, query_trace_id in zip(queries, trace_ids)]
+        if not queries:
+            return results
+        if self.index is None or self.index.ntotal == 0:
+            print(f"[{self.name}] Vector store is not initialized or is empty.")
+            return results
+
+        print(f"[{self.name}] Searching FAISS index with {self.index.ntotal} vectors for {len(queries)} queries...")
+        embeddings = [self.query_cache.get(query.strip()) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            with tracer.span("encode_query", trace_id, queries=len(missing)):
+                encoded = self.model.encode([queries[i] for i in missing], batch_size=self.encode_batch_size)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+                self.query_cache.put(queries[i].strip(), embedding)
+        #print(f"[{self.name}] Query embeddings: {embeddings}")
+        query_embeddings = np.asarray(embeddings, dtype="float32")
+
+        with self._lock.read():
+            k = min(k, self.index.ntotal)
+            depth = max(k, self.hybrid_candidates) if self.hybrid_weight else k
+            # BM25 runs on pool threads while FAISS searches here; both only
+            # read state that is mutated under the write lock.
+            keyword_futures = None
+            if self.hybrid_weight:
+                keyword_futures = [self._keyword_pool.submit(self._keyword_search, query, depth, trace_id)
+                                   for query in queries]
+            vector_hits = [[] for _ in queries]
+            if self.hybrid_weight < 1:
+                vector_hits = self._vector_search(query_embeddings, depth, trace_id)
+            for i, result in enumerate(results):
+                if keyword_futures is None:
+                    live = vector_hits[i][:k]
+                else:
+                    live = reciprocal_rank_fusion(
+                        [vector_hits[i], keyword_futures[i].result()],
+                        [1 - self.hybrid_weight, self.hybrid_weight],
+                        self.rrf_k
+                    )[:k]
+                # Only the returned hits are read from the chunk store
+                hits = []
+                for pos in live:
+                    chunk, metadata = self.chunks_with_metadata.text(pos), self.chunks_with_metadata.metadata(pos)
+                    hits.append((chunk, {**metadata, "chunk_hash": metadata.get("chunk_hash") or hash_chunk(chunk)}))
+                with tracer.span("context_pack", result["trace_id"], hits=len(hits)):
+                    spans, span_hashes = pack_context(hits, self.context_token_budget)
+                result["retrieved_context"] = spans
+                # Every chunk that contributed, so cached answers are invalidated with any of them
+                result["chunk_hashes"] = [chunk_hash for hashes in span_hashes for chunk_hash in hashes]
+                result["context_tokens"] = sum(estimate_tokens(span) for span in spans)
+                result["query_embedding"] = query_embeddings[i].tolist()
+        return results
+
     def process_message(self, message: MCPMessage):
-        if message.type == "EMBED_REQUEST":
-            import pickle
-            print(f"[{self.name}] Received EMBED_REQUEST.")
+        if message.type in ("EMBED_REQUEST", "EMBED_COMPLETE"):
+            print(f"[{self.name}] Received {message.type} (batch {message.payload.get('batch_index', 0)}).")
             chunks = message.payload["chunks"]
-            metadata = message.payload["metadata"]
 
-            if not chunks:
-                print(f"[{self.name}] No chunks to embed.")
-                return
+            if message.type == "EMBED_COMPLETE":
+                # Already encoded by the EmbeddingAgent
+                embeddings = message.payload.get("embeddings")
+            else:
+                embeddings = None
+                if chunks:
+                    with tracer.span("encode", message.trace_id, chunks=len(chunks)):
+                        embeddings = self.model.encode(chunks, batch_size=self.encode_batch_size)
+
+            dropped = []
+            try:
+                # A batch that fails to persist raises, so the Coordinator fails the ingest
+                with self._lock.write():
+                    ready, ingest_complete = self._take_ready_batches(message.payload, embeddings)
+                    for batch, batch_embeddings in ready:
+                        batch_dropped = self._drop_stale_chunks(batch.get("stale_chunks", {}))
+                        if batch_dropped:
+                            print(f"[{self.name}] Dropped {len(batch_dropped)} stale chunks.")
+                            dropped.extend(batch_dropped)
 
-            embeddings = self.model.encode(chunks)
-            embedding_dim = len(embeddings[0])
-            self._initialize_index(embedding_dim)
+                        if batch["chunks"]:
+                            self._add_chunks(batch["chunks"], batch["metadata"], batch_embeddings, message.trace_id)
+                            print(f"[{self.name}] Added {len(batch['chunks'])} chunks to FAISS index.")
+                        else:
+                            print(f"[{self.name}] No chunks to embed.")
+                    self._maybe_rebuild_index()
+            finally:
+                if dropped:
+                    # Cached answers built on dropped chunks must not be served again
+                    self.send_message(MCPMessage(
+                        sender=self.name,
+                        receiver="Coordinator",
+                        type="CACHE_INVALIDATE",
+                        trace_id=message.trace_id,
+                        payload={"chunk_hashes": dropped}
+                    ))
 
-            # Store chunks and metadata before adding to index
-            self.chunks_with_metadata.extend(list(zip(chunks, metadata)))
-            self.index.add(np.array(embeddings).astype('float32'))
+            if ingest_complete:
+                # Notify Coordinator of completion
+                response_msg = MCPMessage(
+                    sender=self.name,
+                    receiver="Coordinator",
+                    type="INGEST_COMPLETE",
+                    trace_id=message.payload.get("ingest_id") or message.trace_id,
+                    payload={"ingest_id": message.payload.get("ingest_id")}
+                )
+                self.send_message(response_msg)
 
-            # Save index and metadata to disk
-            try:
-                faiss.write_index(self.index, self.index_path)
-                with open(self.meta_path, "wb") as f:
-                    pickle.dump(self.chunks_with_metadata, f)
-                print(f"[{self.name}] Saved FAISS index and metadata to disk.")
-            except Exception as e:
-                print(f"[{self.name}] Failed to save FAISS index or metadata: {e}")
+        elif message.type == "INGEST_FAILED":
+            ingest_id = message.payload["ingest_id"]
+            with self._lock.write():
+                held = self._fail_ingest(ingest_id, message.payload.get("batch_index"))
+            print(f"[{self.name}] Abandoned ingest {ingest_id} and {held} held batches: {message.payload['error']}")
+            # Passed on so the IngestionAgent drops its ledger records and removes the files
+            self.send_message(MCPMessage(
+                sender=self.name,
+                receiver="Coordinator",
+                type="INGEST_FAILED",
+                trace_id=message.trace_id,
+                payload=message.payload
+            ))
 
-            print(f"[{self.name}] Added {len(chunks)} chunks to FAISS index.")
+        elif message.type == "DELETE_REQUEST":
+            sources = message.payload["sources"]
+            print(f"[{self.name}] Received DELETE_REQUEST for {', '.join(sources)}.")
+            # Only tombstones here; the rows are purged in the background once enough pile up
+            with tracer.span("delete", message.trace_id, sources=len(sources)):
+                with self._lock.write():
+                    deleted, dropped = self._delete_sources(sources)
+                    self._maybe_rebuild_index()
+            print(f"[{self.name}] Deleted {deleted} chunks.")
 
-            # Notify Coordinator of completion
-            response_msg = MCPMessage(
+            if dropped:
+                self.send_message(MCPMessage(
+                    sender=self.name,
+                    receiver="Coordinator",
+                    type="CACHE_INVALIDATE",
+                    trace_id=message.trace_id,
+                    payload={"chunk_hashes": dropped}
+                ))
+            self.send_message(MCPMessage(
                 sender=self.name,
                 receiver="Coordinator",
-                type="INGEST_COMPLETE",
-                payload={}
-            )
-            self.send_message(response_msg)
+                type="DELETE_COMPLETE",
+                trace_id=message.trace_id,
+                payload={"sources": sources, "deleted_chunks": deleted}
+            ))
 
         elif message.type == "RETRIEVAL_REQUEST":
             print(f"[{self.name}] Received RETRIEVAL_REQUEST.")
@@ -90,30 +639,23 @@ class RetrievalAgent(Agent):
                 import uuid
                 trace_id = str(uuid.uuid4())
 
-            if self.index is None or self.index.ntotal == 0:
-                print(f"[{self.name}] Vector store is not initialized or is empty.")
-                context_chunks = []
-            else:
-                print(f"[{self.name}] Searching FAISS index with {self.index.ntotal} vectors...")
-                embeddings = self.model.encode(query)
-                #print(f"[{self.name}] Query embedding: {embeddings}")
-                query_embedding = np.array([embeddings]).astype('float32')
-                k = min(3, self.index.ntotal) # Retrieve top 5 or fewer if not enough docs
-                distances, indices = self.index.search(query_embedding, k)
-                #print(f"[{self.name}] FAISS search distances: {distances}, indices: {indices}")
-                context_chunks = [self.chunks_with_metadata[i][0] for i in indices[0]]
-                #print(f"[{self.name}] Retrieved {len(context_chunks)} chunks for query.")
-
             response_msg = MCPMessage(
                 sender=self.name,
                 receiver="Coordinator",
                 type="RETRIEVAL_RESPONSE",
                 trace_id=trace_id,
-                payload={
-                    "retrieved_context": context_chunks,
-                    "query": query,
-                    "trace_id": trace_id
-                }
+                payload=self.retrieve([query], [trace_id], trace_id)[0]
             )
             #print(f"[{self.name}] Sending RETRIEVAL_RESPONSE to Coordinator: {response_msg}")
-            self.send_message(response_msg)
\ No newline at end of file
+            self.send_message(response_msg)
+
+        elif message.type == "BATCH_RETRIEVAL_REQUEST":
+            queries = message.payload["queries"]
+            print(f"[{self.name}] Received BATCH_RETRIEVAL_REQUEST with {len(queries)} queries.")
+            self.send_message(MCPMessage(
+                sender=self.name,
+                receiver="Coordinator",
+                type="BATCH_RETRIEVAL_RESPONSE",
+                trace_id=message.trace_id,
+                payload={"results": self.retrieve(queries, message.payload.get("trace_ids") or None, message.trace_id)}
+            ))
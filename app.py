@@ -1,116 +1,92 @@
 import streamlit as st
 import os
+import time
+import queue
 from dotenv import load_dotenv
-import json
 
 from utils.mcp import MCPMessage
-from agents.ingestion_agent import IngestionAgent
-from agents.retrieval_agent import RetrievalAgent
-from agents.response_agent import LLMResponseAgent
+from utils.tracing import configure_from_env
+from utils.ingestion_ledger import hash_file, hash_bytes
+from utils.engine import RAGEngine
 
 os.environ["GRPC_VERBOSITY"] = "ERROR"
 os.environ["GRPC_CPP_MIN_LOG_LEVEL"] = "3"
 
 # --- CONFIGURATION ---
 load_dotenv()
+# Optional span/metrics exporters (RAG_TRACE_JSONL, RAG_METRICS_PORT)
+configure_from_env()
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
-
-# --- COORDINATOR ---
-class Coordinator:
-    """
-    The central coordinator that routes messages between agents.
-    This implements the in-memory pub/sub mechanism for MCP.
-    """
-    def __init__(self):
-        self.agents = {}
-        self.ui_callback = None
-
-    def register_agent(self, agent):
-        self.agents[agent.name] = agent
-
-    def set_ui_callback(self, callback):
-        self.ui_callback = callback
-
-    def send(self, message: MCPMessage):
-        """Routes a message to the appropriate agent or the UI."""
-        
-        try:
-            print('#'*60)
-            msg_dict = message.model_dump() if hasattr(message, 'model_dump') else message.__dict__
-            print("\n[Coordinator] MCP message (pretty print):\n" + json.dumps(msg_dict, indent=2, ensure_ascii=False))
-        except Exception as e:
-            print(f"[Coordinator] MCP message (raw): {message}\n[Pretty print error: {e}]")
-        print(f"Coordinator routing message from {message.sender} to {message.receiver} (Type: {message.type})")
-        print('#'*60)
-        if message.receiver in self.agents:
-            self.agents[message.receiver].process_message(message)
-        elif message.receiver == "Coordinator":
-            # Message is for the coordinator itself to process and re-route
-            if message.type == "EMBED_REQUEST":
-                self.send(MCPMessage(sender="Coordinator", receiver="RetrievalAgent", type="EMBED_REQUEST", payload=message.payload))
-            elif message.type == "RETRIEVAL_RESPONSE":
-                # Use 'retrieved_context' from RetrievalAgent's payload
-                self.send(MCPMessage(
-                    sender="Coordinator",
-                    receiver="LLMResponseAgent",
-                    type="GENERATE_REQUEST",
-                    payload={
-                        "query": message.payload.get("query"),
-                        "context_chunks": message.payload.get("retrieved_context", []),
-                        "trace_id": message.payload.get("trace_id")
-                    }
-                ))
-            elif message.type == "INGEST_COMPLETE":
-                 if self.ui_callback:
-                    self.ui_callback("ingest_complete", {})
-            elif message.type == "GENERATE_RESPONSE":
-                if self.ui_callback:
-                    self.ui_callback("final_answer", message.payload)
-        else:
-            print(f"Warning: No agent or handler registered for receiver '{message.receiver}'")
+# Worker threads per agent type; each agent also gets a bounded inbox of INBOX_SIZE per lane
+AGENT_WORKERS = {"IngestionAgent": 1, "RetrievalAgent": 2, "LLMResponseAgent": 4}
+INBOX_SIZE = 64
+# Agents run as worker processes instead of threads, e.g. RAG_REMOTE_AGENTS="EmbeddingAgent=4,IngestionAgent=1".
+# The EmbeddingAgent only exists when configured here; otherwise the RetrievalAgent encodes in-process.
+REMOTE_AGENTS = {
+    name.strip(): int(count)
+    for name, _, count in (item.partition("=") for item in os.environ.get("RAG_REMOTE_AGENTS", "").split(",") if item.strip())
+}
+# How often the script reruns to pick up finished ingests and answers
+POLL_INTERVAL = 0.3
 
 # --- STREAMLIT UI ---
 
 st.set_page_config(page_title="Agentic RAG Chatbot", layout="wide")
 st.title("🤖 Agentic RAG Chatbot with MCP")
 
-# Initialize session state
-if "coordinator" not in st.session_state:
-    st.session_state.coordinator = Coordinator()
+@st.cache_resource
+def get_engine():
+    """
+    Builds the Coordinator and agents once per process; every browser session
+    attaches to the same embedding model, FAISS index and segment store.
+    """
+    return RAGEngine(workers=AGENT_WORKERS, inbox_size=INBOX_SIZE, remote_agents=REMOTE_AGENTS)
 
-    # Define the UI callback function
-    def ui_callback_handler(event_type, payload):
-        if event_type == "ingest_complete":
-            st.session_state.processing_files = False
-            st.session_state.files_processed = True
-            st.rerun()
-        elif event_type == "final_answer":
-            st.session_state.messages.append({"role": "assistant", "content": payload["answer"], "sources": payload["sources"]})
-            st.session_state.processing_query = False
-            st.rerun()
-
-    st.session_state.coordinator.set_ui_callback(ui_callback_handler)
-
-    # Register agents
-    st.session_state.coordinator.register_agent(IngestionAgent(st.session_state.coordinator.send))
-    # Patch: Check if FAISS DB exists and set files_processed accordingly
-    retrieval_agent = RetrievalAgent(st.session_state.coordinator.send)
-    st.session_state.coordinator.register_agent(retrieval_agent)
-    if getattr(retrieval_agent, 'index', None) is not None and getattr(retrieval_agent, 'chunks_with_metadata', []):
-        st.session_state.files_processed = True
-    st.session_state.coordinator.register_agent(LLMResponseAgent(st.session_state.coordinator.send))
-    print("Coordinator and Agents initialized.")
+engine = get_engine()
+coordinator, retrieval_agent = engine.coordinator, engine.retrieval_agent
 
+# Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "files_processed" not in st.session_state:
     st.session_state.files_processed = False
+# Documents ingested by any session (or found on disk) are searchable by all of them
+if retrieval_agent.index is not None and len(retrieval_agent.chunks_with_metadata):
+    st.session_state.files_processed = True
 if "processing_files" not in st.session_state:
     st.session_state.processing_files = False
-if "processing_query" not in st.session_state:
-    st.session_state.processing_query = False
+# Future for an in-flight ingest; the agents run on Coordinator worker threads,
+# so the result is collected here on the script thread instead of via callbacks.
+if "pending_ingest" not in st.session_state:
+    st.session_state.pending_ingest = None
+if "pending_delete" not in st.session_state:
+    st.session_state.pending_delete = None
+
+pending_ingest = st.session_state.pending_ingest
+if pending_ingest is not None and pending_ingest.done():
+    st.session_state.pending_ingest = None
+    st.session_state.processing_files = False
+    if pending_ingest.exception() is None:
+        st.session_state.files_processed = True
+    else:
+        st.sidebar.error(f"Ingestion failed: {pending_ingest.exception()}")
+
+pending_delete = st.session_state.pending_delete
+if pending_delete is not None and pending_delete.done():
+    st.session_state.pending_delete = None
+    if pending_delete.exception() is None:
+        deleted = pending_delete.result()
+        # Remove the uploads too, so uploading the same file again re-ingests it
+        for source in deleted["sources"]:
+            try:
+                os.remove(os.path.join(UPLOAD_DIR, source))
+            except OSError:
+                pass
+        st.sidebar.success(f"Deleted {', '.join(deleted['sources'])} ({deleted['deleted_chunks']} chunks).")
+    else:
+        st.sidebar.error(f"Deletion failed: {pending_delete.exception()}")
 
 # Sidebar for file upload
 with st.sidebar:
@@ -127,66 +103,114 @@ with st.sidebar:
         skipped_files = []
         for uploaded_file in uploaded_files:
             file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-            if os.path.exists(file_path):
+            data = uploaded_file.getbuffer()
+            # Skip only byte-identical re-uploads; a changed file under an old name is re-ingested
+            if os.path.exists(file_path) and hash_file(file_path) == hash_bytes(data):
                 skipped_files.append(uploaded_file.name)
                 continue
             with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+                f.write(data)
             file_paths.append(file_path)
 
         if skipped_files:
             st.sidebar.warning(f"Skipped duplicate files: {', '.join(skipped_files)}")
         if file_paths:
-            st.info("Processing uploaded files... Please wait.")
-            # Start ingestion process
+            # Start ingestion process; it runs in the background while queries stay available
             ingest_message = MCPMessage(
                 sender="UI",
                 receiver="IngestionAgent",
                 type="INGEST_REQUEST",
                 payload={"file_paths": file_paths}
             )
-            st.session_state.coordinator.send(ingest_message)
+            st.session_state.pending_ingest = coordinator.request(ingest_message)
         else:
             st.session_state.processing_files = False
             if skipped_files:
                 st.sidebar.info("All selected files were already uploaded.")
                 
-if st.session_state.files_processed:
+if st.session_state.processing_files:
+    st.sidebar.info("Processing uploaded files... You can already ask about documents indexed so far.")
+elif st.session_state.files_processed:
     st.sidebar.success("✅ Files processed and ready!")
 
 
+with st.sidebar:
+    documents = retrieval_agent.sources()
+    if documents:
+        st.header("Manage Documents")
+        to_delete = st.multiselect("Indexed documents", documents)
+        if st.button("Delete selected", disabled=not to_delete or st.session_state.pending_delete is not None):
+            # Deleted chunks stop being retrieved at once; the index is compacted later in the background
+            delete_message = MCPMessage(
+                sender="UI",
+                receiver="IngestionAgent",
+                type="DELETE_REQUEST",
+                payload={"sources": to_delete}
+            )
+            st.session_state.pending_delete = coordinator.request(delete_message)
+
+
 # Main chat interface
 if not st.session_state.files_processed and not st.session_state.processing_files:
     st.info("Please upload documents in the sidebar to begin.")
 
+def stream_answer(answer_future, deltas: queue.Queue):
+    """Yields partial answer text as the LLMResponseAgent produces it."""
+    while True:
+        try:
+            yield deltas.get(timeout=0.05)
+        except queue.Empty:
+            if answer_future.done() and deltas.empty():
+                return
+
+def show_sources(sources):
+    if sources:
+        with st.expander("View Sources"):
+            for i, source in enumerate(sources):
+                st.info(f"Source {i+1}:\n\n" + source.strip())
+
 # Display chat messages
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
-        if "sources" in message and message["sources"]:
-            with st.expander("View Sources"):
-                for i, source in enumerate(message["sources"]):
-                    st.info(f"Source {i+1}:\n\n" + source.strip())
+        show_sources(message.get("sources"))
 
 # Chat input
 if prompt := st.chat_input("Ask a question about your documents..."):
-    if not st.session_state.files_processed:
+    if not (st.session_state.files_processed or st.session_state.processing_files):
         st.warning("Please upload and process documents before asking a question.")
     else:
-        st.session_state.processing_query = True
         st.session_state.messages.append({"role": "user", "content": prompt})
-        
+
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Send retrieval request
+        # Send retrieval request; answer tokens are streamed back as they are generated
         retrieval_message = MCPMessage(
             sender="UI",
             receiver="RetrievalAgent",
             type="RETRIEVAL_REQUEST",
             payload={"query": prompt}
         )
-        st.session_state.coordinator.send(retrieval_message)
-
-if st.session_state.processing_query:
-    st.spinner("Thinking...")
\ No newline at end of file
+        deltas = queue.Queue()
+        answer_future = coordinator.request(
+            retrieval_message,
+            on_partial=lambda payload: deltas.put(payload["delta"])
+        )
+        with st.chat_message("assistant"):
+            streamed = st.write_stream(stream_answer(answer_future, deltas))
+            try:
+                payload = answer_future.result()
+                answer, sources = payload["answer"], payload["sources"]
+            except Exception as e:
+                answer, sources = f"An error occurred: {e}", []
+            if not streamed or answer != streamed:
+                # Nothing (or not all of it) was streamed, e.g. a "no context" reply or an error
+                st.markdown(answer)
+            show_sources(sources)
+        st.session_state.messages.append({"role": "assistant", "content": answer, "sources": sources})
+
+# Poll for a running ingest or delete without blocking the coordinator's workers
+if st.session_state.pending_ingest is not None or st.session_state.pending_delete is not None:
+    time.sleep(POLL_INTERVAL)
+    st.rerun()
@@ -0,0 +1,104 @@
+"""
+Answers a JSONL file of questions without the Streamlit UI, e.g. for nightly
+evaluation runs.
+
+Each input line is a JSON object; the question is read from `--question-field`
+(by default the first of question, query, text, body) and its id from
+`--id-field` (by default id or request_id, else the line number). Questions
+are retrieved in batches (one encode call and one FAISS search per batch) and
+answered with at most `--max-llm-calls` LLM calls in flight. One JSON line per
+question is written to `--output` (default `<input>.answers.jsonl`) as answers
+complete:
+
+    {"id": ..., "question": ..., "trace_id": ..., "contexts": [...],
+     "chunk_hashes": [...], "answer": ..., "error": null}
+
+    python batch_runner.py questions.jsonl --output answers.jsonl --max-llm-calls 8
+"""
+import os
+import json
+import time
+import argparse
+from dotenv import load_dotenv
+
+from utils.engine import RAGEngine
+from utils.tracing import configure_from_env
+
+QUESTION_FIELDS = ("question", "query", "text", "body")
+ID_FIELDS = ("id", "request_id")
+
+
+def read_questions(path: str, question_field: str = None, id_field: str = None) -> list:
+    """Returns (id, question) pairs; lines without a question are skipped."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            fields = (question_field,) if question_field else QUESTION_FIELDS
+            question = next((record[field] for field in fields if record.get(field)), None)
+            if question is None:
+                print(f"[BatchRunner] Skipped line {line_number}: no question field.")
+                continue
+            ids = (id_field,) if id_field else ID_FIELDS
+            questions.append((next((record[field] for field in ids if field in record), line_number), question))
+    return questions
+
+
+def run(args):
+    questions = read_questions(args.input, args.question_field, args.id_field)
+    texts = [question for _, question in questions]
+    # The LLM scheduler caps provider calls too; let it admit as many as requested
+    os.environ.setdefault("RAG_LLM_MAX_CONCURRENT", str(args.max_llm_calls))
+    engine = RAGEngine(
+        workers={"IngestionAgent": 1, "RetrievalAgent": 1, "LLMResponseAgent": args.max_llm_calls},
+        stream=False
+    )
+    try:
+        if args.ingest:
+            engine.ingest(args.ingest)
+        start = time.perf_counter()
+        output = args.output or os.path.splitext(args.input)[0] + ".answers.jsonl"
+        with open(output, "w", encoding="utf-8") as out:
+            if args.retrieve_only:
+                results = ((i, retrieval, None) for i, retrieval in enumerate(engine.retrieve(texts, args.batch_size)))
+            else:
+                results = engine.answer_batch(texts, max_in_flight=args.max_llm_calls, batch_size=args.batch_size)
+            for i, retrieval, answer in results:
+                error = answer if isinstance(answer, Exception) else None
+                out.write(json.dumps({
+                    "id": questions[i][0],
+                    "question": questions[i][1],
+                    "trace_id": retrieval["trace_id"],
+                    "contexts": retrieval["retrieved_context"],
+                    "chunk_hashes": retrieval["chunk_hashes"],
+                    "answer": answer["answer"] if isinstance(answer, dict) else None,
+                    "error": f"{type(error).__name__}: {error}" if error else None,
+                }, ensure_ascii=False) + "\n")
+                out.flush()
+        elapsed = time.perf_counter() - start
+        print(f"[BatchRunner] Wrote {len(questions)} results to {output} in {elapsed:.1f}s "
+              f"({len(questions) / elapsed if elapsed else 0:.1f} questions/s).")
+    finally:
+        engine.shutdown(5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieve context for and answer a JSONL file of questions.")
+    parser.add_argument("input", help="JSONL file with one question object per line.")
+    parser.add_argument("--output", help="JSONL file for the results (default: <input>.answers.jsonl).")
+    parser.add_argument("--question-field", help=f"Field holding the question (default: first of {', '.join(QUESTION_FIELDS)}).")
+    parser.add_argument("--id-field", help=f"Field holding the id (default: {' or '.join(ID_FIELDS)}, else the line number).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Questions per batch retrieval.")
+    parser.add_argument("--max-llm-calls", type=int, default=4, help="LLM calls in flight at once.")
+    parser.add_argument("--retrieve-only", action="store_true", help="Only retrieve contexts; no LLM calls.")
+    parser.add_argument("--ingest", nargs="+", help="Files to ingest before answering.")
+    load_dotenv()
+    configure_from_env()
+    os.environ.setdefault("GRPC_VERBOSITY", "ERROR")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
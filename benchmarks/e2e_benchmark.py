@@ -0,0 +1,453 @@
+"""
+End-to-end benchmark of the ingestion and query pipeline.
+
+Generates a synthetic corpus of TXT, PDF, DOCX and CSV files, then drives the
+real agents through the Coordinator (via `RAGEngine`, no Streamlit) with a
+hashing stub in place of the embedding model and `FakeStreamingProvider` in
+place of Gemini, so the numbers reflect the pipeline itself and need no
+network or GPU. Everything runs in a temporary directory.
+
+Reported, and saved as JSON (by default under `benchmark_results/`):
+
+- ingest throughput per format and overall: docs/s, chunks/s and time per stage
+- index persistence: time spent writing segments during ingest, and the cold
+  load of the store by a fresh RetrievalAgent
+- query latency p50/p99 of retrieval alone and of full answers, plus batch
+  retrieval throughput
+- peak RSS of this process (parser worker processes are not included)
+
+Pass `--compare` with an earlier result file to print the change per metric;
+changes for the worse beyond `--threshold` percent are flagged.
+
+    python -m benchmarks.e2e_benchmark --docs-per-format 20 --queries 200
+    python -m benchmarks.e2e_benchmark --compare benchmark_results/e2e_20260101T000000Z.json
+"""
+import os
+import re
+import sys
+import csv
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import numpy as np
+
+FORMATS = ("txt", "pdf", "docx", "csv")
+# Stages recorded by the agents while ingesting, summed per format
+INGEST_STAGES = ("hash", "parse", "split", "encode", "index_add", "keyword_index_add", "persist")
+# Worker threads per agent type, as in app.py
+AGENT_WORKERS = {"IngestionAgent": 1, "RetrievalAgent": 2, "LLMResponseAgent": 4}
+# Metrics printed by --compare: (path in the result, True if higher is better)
+COMPARED_METRICS = [
+    (("ingest_total", "docs_per_s"), True),
+    (("ingest_total", "chunks_per_s"), True),
+    (("persistence", "persist_seconds"), False),
+    (("persistence", "load_seconds"), False),
+    (("queries", "retrieve", "p50_ms"), False),
+    (("queries", "retrieve", "p99_ms"), False),
+    (("queries", "answer", "p50_ms"), False),
+    (("queries", "answer", "p99_ms"), False),
+    (("queries", "batch_retrieve_per_s"), True),
+    (("peak_rss_mb", "total"), False),
+]
+
+
+class HashingEmbedder:
+    """
+    Stand-in for the SentenceTransformer: a normalized bag of hashed words.
+    Deterministic, cheap, and similar texts still get similar vectors.
+    """
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self._buckets: Dict[str, int] = {}
+
+    def _bucket(self, word: str) -> int:
+        bucket = self._buckets.get(word)
+        if bucket is None:
+            bucket = self._buckets[word] = zlib.crc32(word.encode("utf-8")) % self.dim
+        return bucket
+
+    def encode(self, texts, batch_size: int = 64, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+        for i, text in enumerate(texts):
+            buckets = [self._bucket(word) for word in re.findall(r"\w+", text.lower())]
+            if buckets:
+                vectors[i] = np.bincount(buckets, minlength=self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        return vectors[0] if single else vectors
+
+
+# --- Synthetic corpus ---
+
+SYLLABLES = ["ka", "lo", "mi", "ser", "tan", "vo", "rek", "dis", "pra", "nul", "fen", "gor", "ix", "bel", "quo", "stra"]
+
+
+def make_vocabulary(rng: random.Random, size: int) -> List[str]:
+    # Up to four syllables allows about 70,000 distinct words
+    size = min(size, 60_000)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words)
+
+
+def make_paragraphs(rng: random.Random, words: List[str], n_chars: int) -> List[str]:
+    """Paragraphs of Zipf-ish sentences totalling about `n_chars` characters."""
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    paragraphs, total = [], 0
+    while total < n_chars:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            sentence = " ".join(rng.choices(words, weights, k=rng.randint(6, 18)))
+            sentences.append(sentence.capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return paragraphs
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, paragraphs: List[str], line_chars: int = 90, lines_per_page: int = 60):
+    """A minimal text-only PDF (Helvetica, no dependencies) that pypdf can extract."""
+    lines = []
+    for paragraph in paragraphs:
+        words, line = paragraph.split(" "), ""
+        for word in words:
+            if line and len(line) + 1 + len(word) > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.extend([line, ""])
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects = {1: "<< /Type /Catalog /Pages 2 0 R >>", 3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for i, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * i, 5 + 2 * i
+        kids.append(f"{page_id} 0 R")
+        text = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in page_lines) + " ET"
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        objects[content_id] = f"<< /Length {len(text.encode('latin-1'))} >>\nstream\n{text}\nendstream"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for object_id in sorted(objects):
+        out += f"{offsets[object_id]:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_docx(path: str, paragraphs: List[str]):
+    import docx
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_csv(path: str, rng: random.Random, words: List[str], rows: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name", "category", "amount", "description"])
+        for i in range(rows):
+            writer.writerow([i, rng.choice(words).capitalize(), rng.choice(words[:20]),
+                             round(rng.uniform(0, 10000), 2), " ".join(rng.choices(words, k=rng.randint(4, 12)))])
+
+
+def make_corpus(directory: str, args, words: List[str]) -> Dict[str, List[str]]:
+    """Writes `docs_per_format` files of each format; returns their paths by format."""
+    rng = random.Random(args.seed)
+    corpus = {}
+    for fmt in args.formats:
+        paths = []
+        for i in range(args.docs_per_format):
+            path = os.path.join(directory, f"doc_{i:04d}.{fmt}")
+            if fmt == "csv":
+                write_csv(path, rng, words, args.csv_rows)
+            else:
+                paragraphs = make_paragraphs(rng, words, args.doc_chars)
+                if fmt == "txt":
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write("\n\n".join(paragraphs))
+                elif fmt == "pdf":
+                    write_pdf(path, paragraphs)
+                else:
+                    write_docx(path, paragraphs)
+            paths.append(path)
+        corpus[fmt] = paths
+    return corpus
+
+
+# --- Measurement helpers ---
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far (Unix only)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, 1)
+
+
+def stage_seconds() -> Dict[str, float]:
+    from utils.tracing import registry
+    series = registry.snapshot()["histograms"].get("rag_stage_seconds", {})
+    return {stage: series.get(f'{{stage="{stage}"}}', {}).get("sum", 0.0) for stage in INGEST_STAGES}
+
+
+def latency_summary(latencies_ms: List[float]) -> dict:
+    values = np.asarray(latencies_ms)
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
+
+
+def make_queries(rng: random.Random, words: List[str], n: int) -> List[str]:
+    return [" ".join(rng.sample(words[:200], rng.randint(3, 6))) + f" q{i}" for i in range(n)]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# --- Benchmark ---
+
+def run(args) -> dict:
+    from utils.engine import RAGEngine
+    from utils.llm_providers import FakeStreamingProvider
+    from agents.retrieval_agent import RetrievalAgent
+
+    # genai.configure only needs a value; no request reaches Gemini
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("GRPC_VERBOSITY", "ERROR")
+    words = make_vocabulary(random.Random(args.seed), args.vocabulary)
+    workdir = tempfile.mkdtemp(prefix="rag_e2e_")
+    cwd = os.getcwd()
+    embedder = HashingEmbedder(args.dim)
+    engine = None
+    try:
+        corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(corpus_dir)
+        start = time.perf_counter()
+        corpus = make_corpus(corpus_dir, args, words)
+        corpus_seconds = time.perf_counter() - start
+        corpus_mb = sum(os.path.getsize(p) for paths in corpus.values() for p in paths) / (1024 * 1024)
+        print(f"[Benchmark] Generated {sum(len(p) for p in corpus.values())} files ({corpus_mb:.1f} MB) "
+              f"in {corpus_seconds:.1f}s under {workdir}.")
+
+        # The store and ledger use paths relative to the working directory
+        os.chdir(workdir)
+        provider = FakeStreamingProvider(first_token_delay=args.llm_first_token_ms / 1000,
+                                         token_delay=args.llm_token_ms / 1000)
+        engine = RAGEngine(workers=AGENT_WORKERS, provider=provider, stream=not args.no_stream,
+                           embedding_model=embedder)
+
+        # Untimed: starts the parser process pool, so the first format does not pay for it
+        warmup_path = os.path.join(workdir, "warmup.txt")
+        with open(warmup_path, "w", encoding="utf-8") as f:
+            f.write(" ".join(words[:50]))
+        engine.ingest([warmup_path])
+
+        ingest_rows = []
+        for fmt, paths in corpus.items():
+            stages_before, chunks_before = stage_seconds(), len(engine.retrieval_agent.chunks_with_metadata)
+            start = time.perf_counter()
+            engine.ingest(paths)
+            seconds = time.perf_counter() - start
+            stages_after = stage_seconds()
+            chunks = len(engine.retrieval_agent.chunks_with_metadata) - chunks_before
+            ingest_rows.append({
+                "format": fmt,
+                "docs": len(paths),
+                "mb": round(sum(os.path.getsize(p) for p in paths) / (1024 * 1024), 2),
+                "chunks": chunks,
+                "seconds": round(seconds, 3),
+                "docs_per_s": round(len(paths) / seconds, 2),
+                "chunks_per_s": round(chunks / seconds, 1),
+                "stage_seconds": {stage: round(stages_after[stage] - stages_before[stage], 4) for stage in INGEST_STAGES},
+            })
+            print(f"[Benchmark] Ingested {len(paths)} {fmt} files: {chunks} chunks in {seconds:.2f}s.")
+        total_seconds = sum(row["seconds"] for row in ingest_rows)
+        total_docs = sum(row["docs"] for row in ingest_rows)
+        total_chunks = sum(row["chunks"] for row in ingest_rows)
+        ingest_total = {
+            "docs": total_docs,
+            "chunks": total_chunks,
+            "seconds": round(total_seconds, 3),
+            "docs_per_s": round(total_docs / total_seconds, 2) if total_seconds else None,
+            "chunks_per_s": round(total_chunks / total_seconds, 1) if total_seconds else None,
+        }
+        rss_after_ingest = peak_rss_mb()
+
+        # Cold start: a fresh agent loads the segment store written above. Its
+        # load removes unreferenced files, so background compaction must be done
+        engine.retrieval_agent.wait_for_background_work()
+        start = time.perf_counter()
+        reloaded = RetrievalAgent(lambda message: None, model=embedder)
+        load_seconds = time.perf_counter() - start
+        persistence = {
+            "persist_seconds": round(sum(row["stage_seconds"]["persist"] for row in ingest_rows), 4),
+            "load_seconds": round(load_seconds, 4),
+            "loaded_chunks": len(reloaded.chunks_with_metadata),
+            "store_mb": round(sum(os.path.getsize(os.path.join(root, name))
+                                  for root, _, names in os.walk(reloaded.store_dir) for name in names) / (1024 * 1024), 2),
+        }
+        del reloaded
+
+        # Distinct queries per phase, so the query-embedding and answer caches do not hide the work
+        rng = random.Random(args.seed + 1)
+        warmup, retrieve_queries, answer_queries, batch_queries = (
+            make_queries(rng, words, n) for n in (10, args.queries, args.queries, args.queries))
+        for query in warmup:
+            engine.ask(query)
+        retrieve_ms = []
+        for query in retrieve_queries:
+            start = time.perf_counter()
+            engine.retrieve([query])
+            retrieve_ms.append((time.perf_counter() - start) * 1000)
+        answer_ms = []
+        for query in answer_queries:
+            start = time.perf_counter()
+            engine.ask(query)
+            answer_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        engine.retrieve(batch_queries, batch_size=64)
+        batch_seconds = time.perf_counter() - start
+        queries = {
+            "indexed_chunks": len(engine.retrieval_agent.chunks_with_metadata),
+            "retrieve": latency_summary(retrieve_ms),
+            "answer": latency_summary(answer_ms),
+            "batch_retrieve_per_s": round(len(batch_queries) / batch_seconds, 1),
+        }
+    finally:
+        if engine is not None:
+            engine.shutdown(10)
+        os.chdir(cwd)
+        if args.keep:
+            print(f"[Benchmark] Kept the corpus and store in {workdir}.")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "benchmark": "e2e",
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "threshold")},
+        "corpus": {"files": total_docs, "mb": round(corpus_mb, 2), "generate_seconds": round(corpus_seconds, 2)},
+        "ingest": ingest_rows,
+        "ingest_total": ingest_total,
+        "persistence": persistence,
+        "queries": queries,
+        "peak_rss_mb": {"after_ingest": rss_after_ingest, "total": peak_rss_mb()},
+    }
+
+
+def _lookup(result: dict, path: tuple):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def print_report(result: dict, baseline: Optional[dict] = None, threshold: float = 5.0):
+    print(f"\n{'format':<8}{'docs':>6}{'MB':>8}{'chunks':>9}{'seconds':>10}{'docs/s':>10}{'chunks/s':>11}"
+          f"{'parse':>8}{'split':>8}{'encode':>8}{'persist':>9}")
+    for row in result["ingest"] + [{"format": "total", "mb": result["corpus"]["mb"], "stage_seconds": {},
+                                    **result["ingest_total"]}]:
+        stages = row["stage_seconds"]
+        print(f"{row['format']:<8}{row['docs']:>6}{row['mb']:>8.1f}{row['chunks']:>9}{row['seconds']:>10.2f}"
+              f"{row['docs_per_s'] or 0:>10.1f}{row['chunks_per_s'] or 0:>11.0f}"
+              + "".join(f"{stages[s]:>{w}.2f}" if s in stages else f"{'':>{w}}"
+                        for s, w in (("parse", 8), ("split", 8), ("encode", 8), ("persist", 9))))
+    persistence, queries = result["persistence"], result["queries"]
+    print(f"\npersist during ingest {persistence['persist_seconds']:.3f}s, cold load {persistence['load_seconds']:.3f}s "
+          f"({persistence['loaded_chunks']} chunks, {persistence['store_mb']} MB on disk)")
+    print(f"retrieve p50 {queries['retrieve']['p50_ms']:.2f} ms, p99 {queries['retrieve']['p99_ms']:.2f} ms; "
+          f"answer p50 {queries['answer']['p50_ms']:.2f} ms, p99 {queries['answer']['p99_ms']:.2f} ms; "
+          f"batch retrieve {queries['batch_retrieve_per_s']:.0f} queries/s")
+    rss = result["peak_rss_mb"]
+    print(f"peak RSS {rss['after_ingest']} MB after ingest, {rss['total']} MB overall")
+
+    if baseline is not None:
+        print(f"\nCompared with {baseline.get('timestamp')} (commit {baseline.get('git_commit')}):")
+        for path, higher_is_better in COMPARED_METRICS:
+            old, new = _lookup(baseline, path), _lookup(result, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            worse = (-change if higher_is_better else change) > threshold
+            print(f"  {'.'.join(path):<32}{old:>12.3f} -> {new:<12.3f}{change:+7.1f}%{'  REGRESSION' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end ingest and query benchmark with a stub model and fake LLM.")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--docs-per-format", type=int, default=20)
+    parser.add_argument("--doc-chars", type=int, default=20_000, help="Approximate text per TXT/PDF/DOCX file.")
+    parser.add_argument("--csv-rows", type=int, default=2_000, help="Rows per CSV file.")
+    parser.add_argument("--vocabulary", type=int, default=5_000, help="Distinct synthetic words.")
+    parser.add_argument("--dim", type=int, default=384, help="Stub embedding dimension (all-MiniLM-L6-v2 is 384).")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per latency measurement.")
+    parser.add_argument("--llm-first-token-ms", type=float, default=0.0, help="Fake LLM time to first token.")
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="Fake LLM delay per token.")
+    parser.add_argument("--no-stream", action="store_true", help="Generate answers without GENERATE_PARTIAL messages.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="Keep the generated corpus and store.")
+    parser.add_argument("--output", help="JSON result path (default: benchmark_results/e2e_<UTC time>.json).")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against.")
+    parser.add_argument("--threshold", type=float, default=5.0, help="Percent change flagged as a regression.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    result = run(args)
+    print_report(result, baseline, args.threshold)
+
+    output = args.output or os.path.join(
+        "benchmark_results", f"e2e_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\n[Benchmark] Results written to {output}.")
+
+
+if __name__ == "__main__":
+    main()
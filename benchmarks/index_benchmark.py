@@ -0,0 +1,104 @@
+"""
+Benchmarks the approximate index policies against the exact flat baseline.
+
+Generates clustered synthetic vectors (MiniLM-sized by default), builds each
+index through `IndexPolicy.build_index` exactly as the RetrievalAgent would,
+and reports build time, single-query p50/p99 latency and recall@k measured
+against `IndexFlatL2` ground truth.
+
+    python -m benchmarks.index_benchmark --n 200000 --k 3
+"""
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+
+from utils.index_policy import IndexPolicy
+
+
+def make_vectors(n: int, dim: int, n_queries: int, seed: int = 0):
+    """Gaussian clusters, so approximate indexes behave as they do on real embeddings."""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, n // 500)
+    centers = rng.normal(size=(n_clusters, dim)).astype("float32")
+    assign = rng.integers(0, n_clusters, size=n + n_queries)
+    data = centers[assign] + 0.3 * rng.normal(size=(n + n_queries, dim)).astype("float32")
+    return np.ascontiguousarray(data[:n]), np.ascontiguousarray(data[n:])
+
+
+def time_queries(index, queries: np.ndarray, k: int):
+    latencies = []
+    results = np.empty((len(queries), k), dtype="int64")
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return np.array(latencies), results
+
+
+def recall_at_k(results: np.ndarray, ground_truth: np.ndarray) -> float:
+    hits = sum(len(set(r[r >= 0]) & set(g)) for r, g in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+
+def run(args):
+    vectors, queries = make_vectors(args.n, args.dim, args.queries, args.seed)
+    faiss.omp_set_num_threads(args.threads)
+
+    configs = [("flat", IndexPolicy(kind="flat"))]
+    configs += [(f"ivf nprobe={p}", IndexPolicy(kind="ivf", nprobe=p)) for p in args.nprobe]
+    configs += [(f"hnsw efSearch={e}", IndexPolicy(kind="hnsw", ef_search=e)) for e in args.ef_search]
+
+    rows = []
+    built = {}
+    ground_truth = None
+    for label, policy in configs:
+        # Training dominates build time, so reuse one build per kind and only retune search knobs.
+        build_ms = None
+        if policy.kind not in built:
+            start = time.perf_counter()
+            built[policy.kind] = policy.build_index(vectors)
+            build_ms = (time.perf_counter() - start) * 1000
+        index = built[policy.kind]
+        policy.configure_search(index)
+
+        latencies, results = time_queries(index, queries, args.k)
+        if ground_truth is None:
+            ground_truth = results
+        rows.append({
+            "index": label,
+            "build_ms": round(build_ms, 1) if build_ms is not None else None,
+            "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+            f"recall@{args.k}": round(recall_at_k(results, ground_truth), 4),
+        })
+
+    print(f"n={args.n} dim={args.dim} queries={args.queries} k={args.k} threads={args.threads}")
+    print(f"{'index':<22}{'build ms':>12}{'p50 ms':>10}{'p99 ms':>10}{f'recall@{args.k}':>12}")
+    for row in rows:
+        build = f"{row['build_ms']:.1f}" if row["build_ms"] is not None else "-"
+        print(f"{row['index']:<22}{build:>12}{row['p50_ms']:>10.4f}{row['p99_ms']:>10.4f}{row[f'recall@{args.k}']:>12.4f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": rows}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flat vs IVF vs HNSW latency/recall benchmark.")
+    parser.add_argument("--n", type=int, default=100_000, help="Number of indexed vectors.")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimension (all-MiniLM-L6-v2 is 384).")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=3, help="RetrievalAgent retrieves the top 3.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path for a JSON copy of the results.")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measures the per-hop overhead of MCP messages at different payload sizes.
+
+An EMBED_REQUEST-shaped payload of `size` chunks (with metadata) is pushed
+through each hop the Coordinator uses, in the old and the current way:
+
+- in-process re-route: a validated `MCPMessage(...)` vs an unvalidated
+  `MCPMessage.model_construct(...)`
+- process hop (one direction of the socket transport, without the pipe itself):
+  `model_dump` + pickle + unpickle + validation vs `fields()` + pickle +
+  unpickle + validation
+- embedding round trip to a worker process: the whole payload there and back
+  (with embeddings) vs only the chunk text there and a `chunk_ref` plus
+  embeddings back, re-attached from the ChunkBuffer
+
+Each row reports the median time per hop in microseconds and, for the
+process hops, the pickled bytes.
+
+    python -m benchmarks.mcp_hop_benchmark --sizes 1 16 256 4096
+"""
+import argparse
+import json
+import pickle
+import time
+import numpy as np
+
+from utils.mcp import MCPMessage
+from utils.chunk_buffer import ChunkBuffer
+
+
+def make_payload(size: int, chunk_chars: int) -> dict:
+    return {
+        "chunks": [f"{i:08d}" + "x" * (chunk_chars - 8) for i in range(size)],
+        "metadata": [{"source": "bench.txt", "chunk_hash": f"{i:064x}", "file_hash": "f" * 64,
+                      "page": 0, "start": i * chunk_chars, "end": (i + 1) * chunk_chars} for i in range(size)],
+        "stale_chunks": {},
+        "ingest_id": "bench",
+        "batch_index": 0,
+        "final": False,
+    }
+
+
+def median_us(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1e6
+
+
+def dumps(frame) -> bytes:
+    return pickle.dumps(frame, protocol=5)
+
+
+def run(args):
+    rows = []
+    for size in args.sizes:
+        payload = make_payload(size, args.chunk_chars)
+        embeddings = np.zeros((size, args.dim), dtype="float32")
+        message = MCPMessage(sender="IngestionAgent", receiver="Coordinator", type="EMBED_REQUEST", payload=payload)
+        route = dict(sender="Coordinator", receiver="RetrievalAgent", type="EMBED_REQUEST",
+                     trace_id=message.trace_id, payload=message.payload)
+        repeat = max(5, args.repeat // max(1, size // 64))
+
+        def process_hop_old(message=message):
+            return MCPMessage(**pickle.loads(dumps(message.model_dump())))
+
+        def process_hop_new(message=message):
+            return MCPMessage(**pickle.loads(dumps(message.fields())))
+
+        def round_trip_inline(payload=payload, embeddings=embeddings):
+            request = pickle.loads(dumps(payload))
+            reply = pickle.loads(dumps({**request, "embeddings": embeddings}))
+            return reply
+
+        buffer = ChunkBuffer()
+
+        def round_trip_ref(payload=payload, embeddings=embeddings):
+            request = pickle.loads(dumps(buffer.detach(payload, keep=("chunks",))))
+            reply = {**request, "embeddings": embeddings}
+            del reply["chunks"]
+            return buffer.attach(pickle.loads(dumps(reply)))
+
+        inline_bytes = len(dumps(payload)) + len(dumps({**payload, "embeddings": embeddings}))
+        slim = buffer.detach(payload, keep=("chunks",))
+        ref_bytes = len(dumps(slim)) + len(dumps({"chunk_ref": slim["chunk_ref"], "embeddings": embeddings}))
+        buffer.take(slim["chunk_ref"])
+
+        rows.append({
+            "chunks": size,
+            "payload_kb": round(len(dumps(payload)) / 1024, 1),
+            "route_validated_us": round(median_us(lambda: MCPMessage(**route), args.repeat), 2),
+            "route_construct_us": round(median_us(lambda: MCPMessage.model_construct(**route), args.repeat), 2),
+            "process_hop_old_us": round(median_us(process_hop_old, repeat), 1),
+            "process_hop_new_us": round(median_us(process_hop_new, repeat), 1),
+            "embed_round_trip_inline_us": round(median_us(round_trip_inline, repeat), 1),
+            "embed_round_trip_ref_us": round(median_us(round_trip_ref, repeat), 1),
+            "embed_round_trip_inline_kb": round(inline_bytes / 1024, 1),
+            "embed_round_trip_ref_kb": round(ref_bytes / 1024, 1),
+        })
+
+    print(f"chunk_chars={args.chunk_chars} dim={args.dim} (times are medians in microseconds per hop)")
+    print(f"{'chunks':>7}{'KB':>9}{'route':>9}{'construct':>11}{'proc old':>11}{'proc new':>11}"
+          f"{'embed inline':>14}{'embed ref':>11}{'inline KB':>11}{'ref KB':>9}")
+    for row in rows:
+        print(f"{row['chunks']:>7}{row['payload_kb']:>9.1f}{row['route_validated_us']:>9.2f}{row['route_construct_us']:>11.2f}"
+              f"{row['process_hop_old_us']:>11.1f}{row['process_hop_new_us']:>11.1f}"
+              f"{row['embed_round_trip_inline_us']:>14.1f}{row['embed_round_trip_ref_us']:>11.1f}"
+              f"{row['embed_round_trip_inline_kb']:>11.1f}{row['embed_round_trip_ref_kb']:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": rows}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-hop MCP message overhead by payload size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 16, 256, 4096], help="Chunks per payload.")
+    parser.add_argument("--chunk-chars", type=int, default=1000, help="IngestionAgent splits at 1000 characters.")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension (all-MiniLM-L6-v2 is 384).")
+    parser.add_argument("--repeat", type=int, default=2000, help="Repetitions for the smallest payloads.")
+    parser.add_argument("--output", help="Optional path for a JSON copy of the results.")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmarks compressed vector storage against full-precision float32.
+
+For every storage mode (float32, float16, sq8, pq) the index is built through
+`IndexPolicy.build_index` and searched through `IndexPolicy.search`, as in the
+RetrievalAgent. Compressed modes are measured with and without exact
+re-ranking against a memory-mapped float32 `.npy` file. Each row reports the
+index's memory per vector (serialized size / n), single-query p50/p99 latency,
+and recall@k against exact `IndexFlatL2` search.
+
+    python -m benchmarks.storage_benchmark --n 200000 --k 3 --kind flat
+"""
+import os
+import argparse
+import json
+import tempfile
+import time
+import numpy as np
+import faiss
+
+from utils.index_policy import IndexPolicy
+from benchmarks.index_benchmark import make_vectors, recall_at_k
+
+
+def time_policy_queries(policy: IndexPolicy, index, queries: np.ndarray, k: int, full_vectors):
+    latencies = []
+    results = np.empty((len(queries), k), dtype="int64")
+    for i, q in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = policy.search(index, q.reshape(1, -1), k, full_vectors)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = ids[0]
+    return np.array(latencies), results
+
+
+def run(args):
+    vectors, queries = make_vectors(args.n, args.dim, args.queries, args.seed)
+    faiss.omp_set_num_threads(args.threads)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, ground_truth = exact.search(queries, args.k)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Full-precision copy on disk, mapped like the store's base/segment .npy files
+        vectors_path = os.path.join(tmp, "vectors.npy")
+        np.save(vectors_path, vectors)
+        full_vectors = np.load(vectors_path, mmap_mode="r")
+
+        rows = []
+        for storage in args.storage:
+            policy = IndexPolicy(kind=args.kind, storage=storage, pq_m=args.pq_m,
+                                 rerank_factor=args.rerank_factor, nprobe=args.nprobe, ef_search=args.ef_search)
+            start = time.perf_counter()
+            index = policy.build_index(vectors)
+            build_ms = (time.perf_counter() - start) * 1000
+            bytes_per_vector = faiss.serialize_index(index).nbytes / args.n
+            for rerank in ([False, True] if storage != "float32" else [False]):
+                latencies, results = time_policy_queries(
+                    policy, index, queries, args.k, full_vectors if rerank else None
+                )
+                rows.append({
+                    "storage": storage + (" +rerank" if rerank else ""),
+                    "build_ms": round(build_ms, 1),
+                    "bytes_per_vector": round(bytes_per_vector, 1),
+                    "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+                    "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+                    f"recall@{args.k}": round(recall_at_k(results, ground_truth), 4),
+                })
+
+    print(f"n={args.n} dim={args.dim} kind={args.kind} queries={args.queries} k={args.k} "
+          f"rerank_factor={args.rerank_factor} threads={args.threads}")
+    print(f"{'storage':<18}{'build ms':>12}{'B/vector':>10}{'p50 ms':>10}{'p99 ms':>10}{f'recall@{args.k}':>12}")
+    for row in rows:
+        print(f"{row['storage']:<18}{row['build_ms']:>12.1f}{row['bytes_per_vector']:>10.1f}"
+              f"{row['p50_ms']:>10.4f}{row['p99_ms']:>10.4f}{row[f'recall@{args.k}']:>12.4f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "results": rows}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="float32 vs float16/SQ8/PQ storage: memory, latency, recall.")
+    parser.add_argument("--n", type=int, default=100_000, help="Number of indexed vectors.")
+    parser.add_argument("--dim", type=int, default=384, help="Vector dimension (all-MiniLM-L6-v2 is 384).")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=3, help="RetrievalAgent retrieves the top 3.")
+    parser.add_argument("--kind", choices=["flat", "ivf", "hnsw"], default="flat")
+    parser.add_argument("--storage", nargs="+", default=["float32", "float16", "sq8", "pq"])
+    parser.add_argument("--pq-m", type=int, default=48, help="PQ sub-quantizers (bytes per vector).")
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional path for a JSON copy of the results.")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
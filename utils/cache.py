@@ -0,0 +1,143 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, List, Optional
+import numpy as np
+from utils.tracing import registry
+
+
+class _CacheStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        self.hits += 1
+        registry.inc("rag_cache_requests_total", cache=self.name, result="hit")
+
+    def miss(self):
+        self.misses += 1
+        registry.inc("rag_cache_requests_total", cache=self.name, result="miss")
+
+    def as_dict(self, size: int) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+        }
+
+
+class LRUCache:
+    """A thread-safe LRU map bounded by entry count and entry age (`ttl` seconds)."""
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600, name: str = "lru"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = _CacheStats(name)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[1] < self.ttl):
+                self._data.move_to_end(key)
+                self._stats.hit()
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self._stats.miss()
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats.as_dict(len(self._data))
+
+
+class SemanticAnswerCache:
+    """
+    Caches generated answers by query embedding.
+
+    A lookup hits when a stored query is within `threshold` cosine similarity
+    of the new one *and* retrieval returned exactly the same chunks (by content
+    hash), so an answer is never reused over different evidence. Entries that
+    depend on chunks an ingest later drops are removed via `invalidate_chunks`.
+    """
+    def __init__(self, threshold: float = 0.95, max_size: int = 512, ttl: Optional[float] = 3600):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: List[dict] = []
+        self._lock = threading.Lock()
+        self._stats = _CacheStats("semantic_answer")
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32").ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        if self.ttl is not None:
+            now = time.monotonic()
+            self._entries = [e for e in self._entries if now - e["created"] < self.ttl]
+
+    def lookup(self, embedding, chunk_hashes: Iterable[str]) -> Optional[dict]:
+        """Returns {"answer", "sources"} of the closest matching entry, or None."""
+        query = self._normalize(embedding)
+        chunk_hashes = frozenset(chunk_hashes)
+        with self._lock:
+            self._expire()
+            candidates = [e for e in self._entries if e["chunk_hashes"] == chunk_hashes]
+            if candidates:
+                similarities = np.stack([e["embedding"] for e in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = candidates[best]
+                    # Move to the back so eviction stays least-recently-used
+                    self._entries = [e for e in self._entries if e is not entry] + [entry]
+                    self._stats.hit()
+                    return {"answer": entry["answer"], "sources": entry["sources"]}
+            self._stats.miss()
+            return None
+
+    def store(self, embedding, chunk_hashes: Iterable[str], answer: str, sources: list):
+        with self._lock:
+            self._entries.append({
+                "embedding": self._normalize(embedding),
+                "chunk_hashes": frozenset(chunk_hashes),
+                "answer": answer,
+                "sources": sources,
+                "created": time.monotonic(),
+            })
+            if len(self._entries) > self.max_size:
+                self._entries = self._entries[-self.max_size:]
+
+    def invalidate_chunks(self, chunk_hashes: Iterable[str]) -> int:
+        """Drops every answer that was built on any of `chunk_hashes`; returns how many."""
+        affected = set(chunk_hashes)
+        with self._lock:
+            before = len(self._entries)
+            self._entries = [e for e in self._entries if not (e["chunk_hashes"] & affected)]
+            return before - len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return self._stats.as_dict(len(self._entries))
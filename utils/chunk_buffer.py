@@ -0,0 +1,60 @@
+import time
+import uuid
+import threading
+from typing import Dict, Iterable, Optional
+
+
+class ChunkBuffer:
+    """
+    Process-local registry of payload fields held out of band, so MCP
+    messages can carry a `chunk_ref` handle instead of chunk text and
+    metadata. A handle is only valid in the process that created it; each
+    entry is taken once, and entries not taken within `ttl` seconds (e.g.
+    after a failed request) are dropped.
+    """
+    def __init__(self, ttl: float = 600.0):
+        self.ttl = ttl
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def put(self, fields: dict) -> str:
+        handle = f"chunks:{uuid.uuid4().hex}"
+        now = time.monotonic()
+        with self._lock:
+            expired = [h for h, (_, created) in self._entries.items() if now - created > self.ttl]
+            for h in expired:
+                del self._entries[h]
+            self._entries[handle] = (fields, now)
+        return handle
+
+    def take(self, handle: str) -> dict:
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+        if entry is None:
+            raise KeyError(f"Unknown or expired chunk reference {handle}")
+        return entry[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def detach(self, payload: dict, keep: Iterable[str] = ()) -> dict:
+        """
+        Returns a payload holding only the fields in `keep` and a `chunk_ref`;
+        the whole original payload stays here until `attach`.
+        """
+        slim = {field: payload[field] for field in keep if field in payload}
+        slim["chunk_ref"] = self.put(payload)
+        return slim
+
+    def attach(self, payload: dict) -> dict:
+        """Returns `payload` merged over the fields its `chunk_ref` points to (unchanged without one)."""
+        handle: Optional[str] = payload.get("chunk_ref")
+        if handle is None:
+            return payload
+        merged = {**self.take(handle), **payload}
+        del merged["chunk_ref"]
+        return merged
+
+
+chunk_buffer = ChunkBuffer()
@@ -0,0 +1,208 @@
+import io
+import json
+import mmap
+import bisect
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+MAGIC = b"RAGCHNK1"
+# magic | rows | text offset | meta offset | sources offset | sources length | index offset
+HEADER = np.dtype([("magic", "S8"), ("rows", "<u8"), ("text_off", "<u8"), ("meta_off", "<u8"),
+                   ("sources_off", "<u8"), ("sources_len", "<u8"), ("index_off", "<u8")])
+# One fixed-width record per chunk; text and the remaining metadata live in blobs
+ROW = np.dtype([("text_off", "<u8"), ("text_len", "<u4"), ("meta_off", "<u8"), ("meta_len", "<u4"),
+                ("source", "<u4"), ("chunk_hash", "S32")])
+
+
+def _hash_bytes(chunk_hash) -> bytes:
+    """SHA-256 hex digests are stored as 32 raw bytes; anything else stays in the JSON."""
+    if isinstance(chunk_hash, str) and len(chunk_hash) == 64:
+        try:
+            return bytes.fromhex(chunk_hash)
+        except ValueError:
+            pass
+    return b""
+
+
+def write_chunk_file(f, chunks_with_metadata: Iterable[Tuple[str, dict]]):
+    """
+    Writes (chunk, metadata) pairs in the columnar layout read by `ChunkFile`:
+    `source` is dictionary-encoded and `chunk_hash` kept as a fixed-width
+    column, other metadata keys go to a per-row JSON blob.
+    Text is streamed straight to `f`; only the metadata blob and the fixed-width
+    row table are buffered.
+    """
+    f.write(b"\0" * HEADER.itemsize)
+    text_off = f.tell()
+    rows = []
+    meta_blob = io.BytesIO()
+    sources = {}
+    position = 0
+    for chunk, metadata in chunks_with_metadata:
+        text = chunk.encode("utf-8")
+        f.write(text)
+        chunk_hash = _hash_bytes(metadata.get("chunk_hash"))
+        extra = {k: v for k, v in metadata.items() if k != "source" and not (k == "chunk_hash" and chunk_hash)}
+        meta = json.dumps(extra, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if extra else b""
+        meta_start = meta_blob.tell()
+        meta_blob.write(meta)
+        source_id = sources.setdefault(metadata.get("source"), len(sources))
+        rows.append((position, len(text), meta_start, len(meta), source_id, chunk_hash))
+        position += len(text)
+    meta_off = f.tell()
+    f.write(meta_blob.getbuffer())
+    sources_off = f.tell()
+    sources_data = json.dumps(list(sources), ensure_ascii=False).encode("utf-8")
+    f.write(sources_data)
+    # Pad so the row table is 8-byte aligned inside the mapping
+    f.write(b"\0" * (-f.tell() % 8))
+    index_off = f.tell()
+    f.write(np.array(rows, dtype=ROW).tobytes())
+    end = f.tell()
+    f.seek(0)
+    f.write(np.array([(MAGIC, len(rows), text_off, meta_off, sources_off, len(sources_data), index_off)],
+                     dtype=HEADER).tobytes())
+    f.seek(end)
+
+
+class ChunkFile:
+    """
+    Read-only, memory-mapped view of a file written by `write_chunk_file`.
+
+    Opening costs one mmap and a header read regardless of size; rows are
+    decoded only when asked for, and the pages are shared through the OS page
+    cache by every process that maps the same file.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._mmap, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a chunk file.")
+        self._text_off = int(header["text_off"])
+        self._meta_off = int(header["meta_off"])
+        self.rows = np.frombuffer(self._mmap, dtype=ROW, count=int(header["rows"]), offset=int(header["index_off"]))
+        sources_off = int(header["sources_off"])
+        self.sources = json.loads(self._mmap[sources_off:sources_off + int(header["sources_len"])].decode("utf-8"))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def text(self, i: int) -> str:
+        row = self.rows[i]
+        start = self._text_off + int(row["text_off"])
+        return self._mmap[start:start + int(row["text_len"])].decode("utf-8")
+
+    def metadata(self, i: int) -> dict:
+        row = self.rows[i]
+        start = self._meta_off + int(row["meta_off"])
+        meta = {"source": self.sources[row["source"]]}
+        if row["chunk_hash"]:
+            meta["chunk_hash"] = row["chunk_hash"].ljust(32, b"\0").hex()
+        if row["meta_len"]:
+            meta.update(json.loads(self._mmap[start:start + int(row["meta_len"])].decode("utf-8")))
+        return meta
+
+    def __getitem__(self, i: int) -> Tuple[str, dict]:
+        return self.text(i), self.metadata(i)
+
+    def keys(self) -> Iterator[Tuple[str, Optional[str]]]:
+        """(source, chunk_hash) of every row; reads the metadata blob only for non-SHA-256 hashes."""
+        for i, (source_id, chunk_hash, meta_len) in enumerate(zip(self.rows["source"], self.rows["chunk_hash"], self.rows["meta_len"])):
+            if chunk_hash:
+                yield self.sources[source_id], chunk_hash.ljust(32, b"\0").hex()
+            else:
+                yield self.sources[source_id], self.metadata(i).get("chunk_hash") if meta_len else None
+
+
+class InMemoryChunks:
+    """A list of (chunk, metadata) pairs behind the `ChunkFile` interface."""
+    def __init__(self, chunks_with_metadata: List[Tuple[str, dict]]):
+        self.items = list(chunks_with_metadata)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def text(self, i: int) -> str:
+        return self.items[i][0]
+
+    def metadata(self, i: int) -> dict:
+        return self.items[i][1]
+
+    def __getitem__(self, i: int) -> Tuple[str, dict]:
+        return self.items[i]
+
+    def keys(self) -> Iterator[Tuple[str, Optional[str]]]:
+        for _, meta in self.items:
+            yield meta.get("source"), meta.get("chunk_hash")
+
+
+class ChunkTable:
+    """
+    The chunk list of the whole index, addressed by FAISS position: the base
+    and segment files (or in-memory batches) concatenated in order.
+    """
+    def __init__(self, parts: Sequence = ()):
+        self.parts = []
+        self._starts = []
+        self._length = 0
+        for part in parts:
+            self.add_part(part)
+
+    def add_part(self, part):
+        if len(part):
+            self.parts.append(part)
+            self._starts.append(self._length)
+            self._length += len(part)
+
+    def extend(self, chunks_with_metadata: List[Tuple[str, dict]]):
+        self.add_part(InMemoryChunks(chunks_with_metadata))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _locate(self, i: int):
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("chunk position out of range")
+        p = bisect.bisect_right(self._starts, i) - 1
+        return self.parts[p], i - self._starts[p]
+
+    def text(self, i: int) -> str:
+        part, j = self._locate(i)
+        return part.text(j)
+
+    def metadata(self, i: int) -> dict:
+        part, j = self._locate(i)
+        return part.metadata(j)
+
+    def __getitem__(self, i: int) -> Tuple[str, dict]:
+        part, j = self._locate(i)
+        return part[j]
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        for part in self.parts:
+            for j in range(len(part)):
+                yield part[j]
+
+    def iter_texts(self, start: int = 0) -> Iterator[str]:
+        for part, part_start in zip(self.parts, self._starts):
+            for j in range(max(0, start - part_start), len(part)):
+                yield part.text(j)
+
+    def keys(self) -> Iterator[Tuple[str, Optional[str]]]:
+        for part in self.parts:
+            yield from part.keys()
+
+    def parts_from(self, start: int) -> list:
+        """The parts holding positions `start` onwards; `start` must be a part boundary."""
+        if start != self._length and start not in self._starts:
+            raise ValueError(f"Position {start} is not the start of a part.")
+        return [part for part, part_start in zip(self.parts, self._starts) if part_start >= start]
+
+    def select(self, positions: Iterable[int]) -> Iterator[Tuple[str, dict]]:
+        """The rows at `positions`, in that order; used to write purged snapshots."""
+        for i in positions:
+            yield self[int(i)]
@@ -0,0 +1,96 @@
+from typing import Dict, List, Optional, Tuple
+
+# Rough English average for Gemini/SentencePiece-style tokenizers; no tokenizer is loaded
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def chunk_offsets(text: str, chunks: List[str]) -> List[int]:
+    """
+    Start offset of each chunk in `text`, for chunks produced in order by a
+    splitter (they may overlap); -1 for a chunk that cannot be found.
+    """
+    offsets = []
+    search_from = 0
+    for chunk in chunks:
+        start = text.find(chunk, search_from)
+        if start < 0:
+            start = text.find(chunk)
+        offsets.append(start)
+        if start >= 0:
+            search_from = start + 1
+    return offsets
+
+
+class _Span:
+    def __init__(self, rank: int, text: str, metadata: dict):
+        self.rank = rank
+        self.text = text
+        self.start = metadata.get("start")
+        self.end = self.start + len(text) if self.start is not None else None
+        self.chunk_hashes = [metadata.get("chunk_hash")]
+
+    def absorb(self, other: "_Span") -> bool:
+        """Merges a span starting at or after this one if they touch or overlap; returns whether it did."""
+        if other.start > self.end:
+            return False
+        overlap = self.end - other.start
+        # Offsets are only trusted if the overlapping text really matches
+        if self.text[other.start - self.start:] != other.text[:overlap]:
+            return False
+        self.text += other.text[overlap:]
+        self.end = max(self.end, other.end)
+        self.rank = min(self.rank, other.rank)
+        self.chunk_hashes += other.chunk_hashes
+        return True
+
+
+def pack_context(hits: List[Tuple[str, dict]], token_budget: Optional[int]) -> Tuple[List[str], List[List[str]]]:
+    """
+    Turns ranked (chunk, metadata) hits into prompt context.
+
+    Hits from the same version of the same page (`source`, `file_hash`,
+    `page`) whose `start` offsets show they touch or overlap are merged into
+    one contiguous span, so the chunk overlap is sent once. Spans are then
+    taken in order of their best hit until `token_budget` (estimated) is
+    used up; a span that does not fit is skipped in favour of smaller ones
+    below it, and the top span is truncated if nothing else fits.
+
+    Returns the span texts, best first, and the chunk hashes of each span.
+    """
+    groups: Dict[tuple, List[_Span]] = {}
+    spans = []
+    for rank, (chunk, metadata) in enumerate(hits):
+        span = _Span(rank, chunk, metadata)
+        if span.start is None or span.start < 0:
+            spans.append(span)
+        else:
+            key = (metadata.get("source"), metadata.get("file_hash"), metadata.get("page", 0))
+            groups.setdefault(key, []).append(span)
+    for group in groups.values():
+        group.sort(key=lambda span: (span.start, -span.end))
+        current = group[0]
+        for span in group[1:]:
+            if not current.absorb(span):
+                spans.append(current)
+                current = span
+        spans.append(current)
+    spans.sort(key=lambda span: span.rank)
+
+    texts, hashes = [], []
+    remaining = token_budget
+    for span in spans:
+        tokens = estimate_tokens(span.text)
+        if remaining is not None and tokens > remaining:
+            if texts:
+                continue
+            span.text = span.text[:remaining * CHARS_PER_TOKEN]
+            tokens = remaining
+        texts.append(span.text)
+        hashes.append(span.chunk_hashes)
+        if remaining is not None:
+            remaining -= tokens
+    return texts, hashes
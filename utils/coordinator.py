@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+from utils.mcp import MCPMessage
+from utils.tracing import registry, tracer
+from utils.transport import ProcessAgentPool
+from utils.chunk_buffer import chunk_buffer
+
+# Bulk work waits behind interactive work in an agent's inbox, so a long
+# ingestion or an evaluation run never sits in front of a user's query. Lanes do
+# not order an agent's workers; the IngestionAgent holds back a delete until the
+# ingests of its files are stored (and vice versa).
+BULK_MESSAGE_TYPES = {"INGEST_REQUEST", "EMBED_REQUEST", "EMBED_COMPLETE", "DELETE_REQUEST",
+                      "BATCH_RETRIEVAL_REQUEST"}
+# Steps of an ingest; their trace_id is the ingest_id
+INGEST_MESSAGE_TYPES = {"INGEST_REQUEST", "EMBED_REQUEST", "EMBED_COMPLETE"}
+
+
+class InboxClosed(Exception):
+    pass
+
+
+class Inbox:
+    """
+    A bounded, two-lane inbox for one agent type.
+
+    Interactive messages are always taken before bulk ones. Each lane holds
+    at most `maxsize` messages; `put` blocks the sender while its lane is
+    full, which is how backpressure reaches a fast producer.
+    """
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._lanes = {"interactive": deque(), "bulk": deque()}
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, message: MCPMessage, timeout: Optional[float] = None):
+        lane = self._lanes["bulk" if message.type in BULK_MESSAGE_TYPES else "interactive"]
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or len(lane) < self.maxsize, timeout):
+                raise TimeoutError(f"Inbox full for {message.receiver}; message {message.type} not delivered.")
+            if self._closed:
+                raise InboxClosed(message.receiver)
+            lane.append((message, time.perf_counter()))
+            self._cond.notify_all()
+
+    def get(self) -> MCPMessage:
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or any(self._lanes.values()))
+            for lane in self._lanes.values():
+                if lane:
+                    message, enqueued_at = lane.popleft()
+                    self._cond.notify_all()
+                    break
+            else:
+                raise InboxClosed()
+        tracer.record("queue_wait", time.perf_counter() - enqueued_at, message.trace_id, agent=message.receiver)
+        return message
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def qsize(self) -> int:
+        with self._cond:
+            return sum(len(lane) for lane in self._lanes.values())
+
+
+class Coordinator:
+    """
+    The central coordinator that routes messages between agents.
+    This implements the in-memory pub/sub mechanism for MCP.
+
+    Each registered agent gets a bounded inbox and a pool of worker threads
+    (`workers`, per agent name, falling back to `default_workers`), so
+    ingestion, retrieval and generation run concurrently and `send` returns as
+    soon as the message is queued. With `default_workers=0` and no overrides
+    messages are delivered by direct call, as before.
+
+    `request` starts a pipeline and returns a Future that resolves with the
+    payload of the terminal message carrying the same trace_id.
+
+    Agents registered with `register_remote_agent` run in a pool of worker
+    processes instead (see `utils.transport`); routing is the same either
+    way, so moving an agent out of process is a configuration change.
+
+    Full message payloads are pretty-printed only for a `payload_log_sample_rate`
+    fraction of messages (default from RAG_DEBUG_PAYLOAD_SAMPLE, off if unset).
+    """
+    def __init__(self, workers: Optional[Dict[str, int]] = None, default_workers: int = 1,
+                 inbox_size: int = 64, put_timeout: Optional[float] = None,
+                 payload_log_sample_rate: Optional[float] = None):
+        self.agents = {}
+        self.ui_callback = None
+        self.workers = workers or {}
+        self.default_workers = default_workers
+        self.inbox_size = inbox_size
+        self.put_timeout = put_timeout
+        if payload_log_sample_rate is None:
+            payload_log_sample_rate = float(os.environ.get("RAG_DEBUG_PAYLOAD_SAMPLE", 0))
+        self.payload_log_sample_rate = payload_log_sample_rate
+        self.inboxes: Dict[str, Inbox] = {}
+        self.remote_pools: Dict[str, ProcessAgentPool] = {}
+        self._threads = []
+        self._pending: Dict[str, Future] = {}
+        self._partial_listeners: Dict[str, Callable[[dict], None]] = {}
+        self._pending_lock = threading.Lock()
+
+    def register_agent(self, agent):
+        self.agents[agent.name] = agent
+        n_workers = self.workers.get(agent.name, self.default_workers)
+        if n_workers <= 0:
+            return
+        inbox = Inbox(self.inbox_size)
+        self.inboxes[agent.name] = inbox
+        for i in range(n_workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                args=(agent, inbox),
+                name=f"{agent.name}-worker-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def register_remote_agent(self, name: str, factory: Callable, processes: int = 1, **factory_kwargs):
+        """
+        Runs the agent `factory(send, **factory_kwargs)` builds as `processes`
+        worker processes. `factory` must be importable (e.g. an agent class).
+        """
+        self.remote_pools[name] = ProcessAgentPool(
+            name, factory, processes,
+            on_message=self.send,
+            on_error=self._agent_failed,
+            factory_kwargs=factory_kwargs
+        )
+        print(f"[Coordinator] Started {processes} {name} worker process(es).")
+
+    def _has_agent(self, name: str) -> bool:
+        return name in self.agents or name in self.remote_pools
+
+    def set_ui_callback(self, callback):
+        self.ui_callback = callback
+
+    def request(self, message: MCPMessage, on_partial: Optional[Callable[[dict], None]] = None) -> Future:
+        """
+        Sends a message and returns a Future for the response with its trace_id.
+        `on_partial` is called (on a worker thread) with each GENERATE_PARTIAL payload.
+        """
+        future = Future()
+        with self._pending_lock:
+            self._pending[message.trace_id] = future
+            if on_partial is not None:
+                self._partial_listeners[message.trace_id] = on_partial
+        try:
+            self.send(message)
+        except Exception as e:
+            self._resolve(message.trace_id, error=e)
+        return future
+
+    def _resolve(self, trace_id: str, payload: dict = None, error: Exception = None):
+        with self._pending_lock:
+            future = self._pending.pop(trace_id, None)
+            self._partial_listeners.pop(trace_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(payload)
+
+    def _worker_loop(self, agent, inbox: Inbox):
+        while True:
+            try:
+                message = inbox.get()
+            except InboxClosed:
+                return
+            try:
+                agent.process_message(message)
+            except Exception as e:
+                print(f"[Coordinator] {agent.name} failed on {message.type}: {e}")
+                registry.inc("mcp_agent_errors_total", agent=agent.name, type=message.type)
+                self._agent_failed(message, e)
+
+    def _agent_failed(self, message: MCPMessage, error: Exception):
+        """
+        Fails the request behind `message`. A failed ingest step abandons the
+        whole ingest: the RetrievalAgent drops its remaining batches and passes
+        the INGEST_FAILED on, which fails the request once the IngestionAgent has it.
+        """
+        if message.type == "DELETE_REQUEST" and message.receiver == "RetrievalAgent" and self._has_agent("IngestionAgent"):
+            # Closes the delete, so requests for the same files are not held up forever
+            self.send(MCPMessage(sender="Coordinator", receiver="IngestionAgent", type="DELETE_COMPLETE",
+                                 trace_id=message.trace_id,
+                                 payload={"sources": message.payload.get("sources", []), "deleted_chunks": 0}))
+        if message.type not in INGEST_MESSAGE_TYPES or not self._has_agent("RetrievalAgent"):
+            self._resolve(message.trace_id, error=error)
+            return
+        if message.payload.get("chunk_ref"):
+            try:
+                chunk_buffer.take(message.payload["chunk_ref"])
+            except KeyError:
+                pass
+        payload = {"ingest_id": message.trace_id, "error": f"{message.receiver} failed on {message.type}: {error}"}
+        if message.type != "INGEST_REQUEST":
+            payload["batch_index"] = message.payload.get("batch_index", 0)
+        try:
+            self.send(MCPMessage(sender="Coordinator", receiver="RetrievalAgent", type="INGEST_FAILED",
+                                 trace_id=message.trace_id, payload=payload))
+        except Exception:
+            self._resolve(message.trace_id, error=error)
+
+    def send(self, message: MCPMessage):
+        """Routes a message to the appropriate agent or the UI."""
+
+        registry.inc("mcp_messages_total", type=message.type, receiver=message.receiver)
+        # Full payloads (chunk lists, prompts) are only serialized for a sampled fraction of messages
+        if self.payload_log_sample_rate and random.random() < self.payload_log_sample_rate:
+            try:
+                msg_dict = message.fields()
+                print("\n[Coordinator] MCP message (pretty print):\n" + json.dumps(msg_dict, indent=2, ensure_ascii=False))
+            except Exception as e:
+                print(f"[Coordinator] MCP message (raw): {message}\n[Pretty print error: {e}]")
+        if message.type != "GENERATE_PARTIAL":
+            print(f"Coordinator routing message from {message.sender} to {message.receiver} (Type: {message.type}, trace {message.trace_id})")
+        if message.receiver in self.remote_pools:
+            self.remote_pools[message.receiver].dispatch(message)
+        elif message.receiver in self.inboxes:
+            self.inboxes[message.receiver].put(message, timeout=self.put_timeout)
+        elif message.receiver in self.agents:
+            try:
+                self.agents[message.receiver].process_message(message)
+            except Exception as e:
+                # Direct delivery: the sender gets the error too, as before
+                self._agent_failed(message, e)
+                raise
+        elif message.receiver == "Coordinator":
+            # Message is for the coordinator itself to process and re-route
+            if message.type == "EMBED_REQUEST":
+                # Encoding goes to the EmbeddingAgent pool when one is configured
+                receiver = "EmbeddingAgent" if self._has_agent("EmbeddingAgent") else "RetrievalAgent"
+                payload = message.payload
+                if receiver in self.remote_pools:
+                    # Worker processes only need the text; metadata stays here and
+                    # the chunks are not pickled back with the embeddings
+                    payload = chunk_buffer.detach(payload, keep=("chunks",))
+                self.send(MCPMessage(sender="Coordinator", receiver=receiver, type="EMBED_REQUEST",
+                                     trace_id=message.trace_id, payload=payload))
+            elif message.type == "EMBED_COMPLETE":
+                self.send(MCPMessage(sender="Coordinator", receiver="RetrievalAgent", type="EMBED_COMPLETE",
+                                     trace_id=message.trace_id, payload=chunk_buffer.attach(message.payload)))
+            elif message.type == "DELETE_REQUEST":
+                # The IngestionAgent has forgotten the sources; the RetrievalAgent drops their chunks
+                self.send(MCPMessage(sender="Coordinator", receiver="RetrievalAgent", type="DELETE_REQUEST",
+                                     trace_id=message.trace_id, payload=message.payload))
+            elif message.type == "RETRIEVAL_RESPONSE":
+                # Use 'retrieved_context' from RetrievalAgent's payload
+                self.send(MCPMessage(
+                    sender="Coordinator",
+                    receiver="LLMResponseAgent",
+                    type="GENERATE_REQUEST",
+                    trace_id=message.trace_id,
+                    payload={
+                        "query": message.payload.get("query"),
+                        "context_chunks": message.payload.get("retrieved_context", []),
+                        "chunk_hashes": message.payload.get("chunk_hashes", []),
+                        "query_embedding": message.payload.get("query_embedding"),
+                        "trace_id": message.payload.get("trace_id")
+                    }
+                ))
+            elif message.type == "CACHE_INVALIDATE":
+                if "LLMResponseAgent" in self.agents:
+                    self.send(MCPMessage(sender="Coordinator", receiver="LLMResponseAgent", type="CACHE_INVALIDATE",
+                                         trace_id=message.trace_id, payload=message.payload))
+            elif message.type == "INGEST_COMPLETE":
+                # The IngestionAgent commits its ledger records before the next request can reach it
+                if self._has_agent("IngestionAgent"):
+                    self.send(MCPMessage(sender="Coordinator", receiver="IngestionAgent", type="INGEST_COMPLETE",
+                                         trace_id=message.trace_id, payload=message.payload))
+                self._resolve(message.trace_id, message.payload)
+                if self.ui_callback:
+                    self.ui_callback("ingest_complete", message.payload)
+            elif message.type == "INGEST_FAILED" and message.sender != "RetrievalAgent":
+                # The RetrievalAgent drops the ingest's batches first, then passes it back
+                self.send(MCPMessage(sender="Coordinator", receiver="RetrievalAgent", type="INGEST_FAILED",
+                                     trace_id=message.trace_id, payload=message.payload))
+            elif message.type == "INGEST_FAILED":
+                # Resolved first: the clean-up delete reuses the ingest's trace_id. Requests
+                # for the same files wait at the IngestionAgent until it is done.
+                self._resolve(message.trace_id, error=RuntimeError(message.payload.get("error")))
+                if self._has_agent("IngestionAgent"):
+                    self.send(MCPMessage(sender="Coordinator", receiver="IngestionAgent", type="INGEST_FAILED",
+                                         trace_id=message.trace_id, payload=message.payload))
+            elif message.type == "BATCH_RETRIEVAL_RESPONSE":
+                # Batches are not answered automatically; the caller decides what to generate
+                self._resolve(message.trace_id, message.payload)
+            elif message.type == "DELETE_COMPLETE":
+                # Lets the IngestionAgent start requests held up behind this delete
+                if self._has_agent("IngestionAgent"):
+                    self.send(MCPMessage(sender="Coordinator", receiver="IngestionAgent", type="DELETE_COMPLETE",
+                                         trace_id=message.trace_id, payload=message.payload))
+                self._resolve(message.trace_id, message.payload)
+                if self.ui_callback:
+                    self.ui_callback("delete_complete", message.payload)
+            elif message.type == "GENERATE_PARTIAL":
+                with self._pending_lock:
+                    listener = self._partial_listeners.get(message.trace_id)
+                if listener:
+                    try:
+                        listener(message.payload)
+                    except Exception as e:
+                        print(f"[Coordinator] Partial listener for {message.trace_id} failed: {e}")
+                if self.ui_callback:
+                    self.ui_callback("partial_answer", message.payload)
+            elif message.type == "GENERATE_RESPONSE":
+                self._resolve(message.trace_id, message.payload)
+                if self.ui_callback:
+                    self.ui_callback("final_answer", message.payload)
+        else:
+            print(f"Warning: No agent or handler registered for receiver '{message.receiver}'")
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Stops the worker threads once they finish their current message, and the worker processes."""
+        for pool in self.remote_pools.values():
+            pool.shutdown(timeout)
+        for inbox in self.inboxes.values():
+            inbox.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
@@ -1,23 +1,32 @@
 import os
-import pandas as pd
+import csv
+import io
 import pypdf
 import docx
 import pptx
-from typing import List
+from typing import List, Iterator, Optional, Tuple
 
 def parse_txt(file_path: str) -> str:
     """Parses a text or markdown file."""
     with open(file_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def parse_pdf(file_path: str) -> str:
-    """Parses a PDF file."""
-    text = ""
+def count_pdf_pages(file_path: str) -> int:
+    with open(file_path, 'rb') as f:
+        return len(pypdf.PdfReader(f).pages)
+
+def iter_pdf_pages(file_path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """Yields the text of pages [start, stop) one at a time."""
     with open(file_path, 'rb') as f:
         reader = pypdf.PdfReader(f)
-        for page in reader.pages:
-            text += page.extract_text() or ""
-    return text
+        pages = reader.pages
+        stop = len(pages) if stop is None else min(stop, len(pages))
+        for i in range(start, stop):
+            yield pages[i].extract_text() or ""
+
+def parse_pdf(file_path: str) -> str:
+    """Parses a PDF file."""
+    return "".join(iter_pdf_pages(file_path))
 
 def parse_docx(file_path: str) -> str:
     """Parses a DOCX file."""
@@ -34,10 +43,57 @@ def parse_pptx(file_path: str) -> str:
                 text.append(shape.text)
     return "\n".join(text)
 
+def _csv_line(row: List[str]) -> str:
+    out = io.StringIO()
+    csv.writer(out, lineterminator="").writerow(row)
+    return out.getvalue()
+
+def iter_csv_row_groups(file_path: str, max_chars: int = 1000) -> Iterator[Tuple[str, int, int]]:
+    """
+    Streams a CSV file as (text, first_row, last_row) groups of whole rows,
+    each starting with the header line and at most `max_chars` long unless a
+    single row is longer. Rows are numbered from 1 after the header. Only one
+    group is held in memory at a time.
+    """
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = _csv_line(header)
+        lines, size, first_row, last_row = [], len(header), 1, 0
+        for row_number, row in enumerate(reader, 1):
+            if not row:
+                continue
+            line = _csv_line(row)
+            if lines and size + 1 + len(line) > max_chars:
+                yield "\n".join([header] + lines), first_row, last_row
+                lines, size, first_row = [], len(header), row_number
+            lines.append(line)
+            size += 1 + len(line)
+            # Blank rows are skipped, so groups end on the last row they hold
+            last_row = row_number
+        if lines:
+            yield "\n".join([header] + lines), first_row, last_row
+
 def parse_csv(file_path: str) -> str:
     """Parses a CSV file into a string representation."""
-    df = pd.read_csv(file_path)
-    return df.to_string()
+    return "\n\n".join(text for text, _, _ in iter_csv_row_groups(file_path))
+
+def iter_document_pages(file_path: str) -> Iterator[str]:
+    """
+    Yields a document's text page by page so callers can start splitting
+    before the whole file is parsed. PDFs have real pages and CSV files are
+    yielded as row groups; other formats are yielded as a single page.
+    """
+    _, extension = os.path.splitext(file_path)
+    if extension.lower() == ".pdf":
+        yield from iter_pdf_pages(file_path)
+    elif extension.lower() == ".csv":
+        for text, _, _ in iter_csv_row_groups(file_path):
+            yield text
+    else:
+        yield parse_document(file_path)
 
 def parse_document(file_path: str) -> str:
     """
@@ -0,0 +1,114 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from utils.mcp import MCPMessage
+from utils.coordinator import Coordinator
+from utils.llm_providers import LLMProvider
+from agents.ingestion_agent import IngestionAgent
+from agents.embedding_agent import EmbeddingAgent
+from agents.retrieval_agent import RetrievalAgent
+from agents.response_agent import LLMResponseAgent
+
+
+class RAGEngine:
+    """
+    The Coordinator and agents behind a plain Python API, for scripts,
+    notebooks and batch runs without Streamlit. The app builds the same engine.
+
+    `workers` and `inbox_size` configure the Coordinator, and `remote_agents`
+    maps agent names to worker-process counts (see `RAG_REMOTE_AGENTS`).
+    `provider` and `stream` are passed to the LLMResponseAgent, and
+    `embedding_model` (default: the SentenceTransformer) to the RetrievalAgent.
+    """
+    def __init__(self, workers: Optional[Dict[str, int]] = None, inbox_size: int = 64,
+                 remote_agents: Optional[Dict[str, int]] = None, provider: LLMProvider = None,
+                 stream: bool = True, embedding_model=None):
+        remote_agents = remote_agents or {}
+        self.coordinator = Coordinator(workers=workers, inbox_size=inbox_size)
+        if remote_agents.get("IngestionAgent"):
+            # One process: the ingestion ledger is a single file
+            self.coordinator.register_remote_agent("IngestionAgent", IngestionAgent, 1)
+        else:
+            self.coordinator.register_agent(IngestionAgent(self.coordinator.send))
+        if remote_agents.get("EmbeddingAgent"):
+            self.coordinator.register_remote_agent("EmbeddingAgent", EmbeddingAgent, remote_agents["EmbeddingAgent"])
+        self.retrieval_agent = RetrievalAgent(self.coordinator.send, model=embedding_model)
+        self.coordinator.register_agent(self.retrieval_agent)
+        self.coordinator.register_agent(LLMResponseAgent(self.coordinator.send, provider=provider, stream=stream))
+        print("Coordinator and Agents initialized.")
+
+    def _request(self, receiver: str, message_type: str, payload: dict, trace_id: str = None) -> Future:
+        message = MCPMessage(sender="UI", receiver=receiver, type=message_type, payload=payload,
+                             **({"trace_id": trace_id} if trace_id else {}))
+        return self.coordinator.request(message)
+
+    def ingest(self, file_paths: List[str], timeout: Optional[float] = None) -> dict:
+        """Ingests the files and waits until all their chunks are searchable."""
+        return self._request("IngestionAgent", "INGEST_REQUEST", {"file_paths": file_paths}).result(timeout)
+
+    def delete(self, sources: List[str], timeout: Optional[float] = None) -> dict:
+        """Removes every chunk of the given sources (file names)."""
+        return self._request("IngestionAgent", "DELETE_REQUEST", {"sources": sources}).result(timeout)
+
+    def ask(self, question: str, timeout: Optional[float] = None) -> dict:
+        """Runs the full pipeline for one question; returns the GENERATE_RESPONSE payload."""
+        return self._request("RetrievalAgent", "RETRIEVAL_REQUEST", {"query": question}).result(timeout)
+
+    def retrieve(self, queries: List[str], batch_size: int = 64, timeout: Optional[float] = None) -> List[dict]:
+        """
+        Retrieves context for many queries, `batch_size` per BATCH_RETRIEVAL_REQUEST.
+        Returns one RETRIEVAL_RESPONSE-style payload per query, in order, each
+        with the trace_id used for that query.
+        """
+        futures = [
+            self._request("RetrievalAgent", "BATCH_RETRIEVAL_REQUEST", {"queries": queries[start:start + batch_size]})
+            for start in range(0, len(queries), batch_size)
+        ]
+        return [result for future in futures for result in future.result(timeout)["results"]]
+
+    def generate(self, retrieval: dict) -> Future:
+        """Starts answer generation for one `retrieve` result, under its trace_id."""
+        return self._request("LLMResponseAgent", "GENERATE_REQUEST", {
+            "query": retrieval["query"],
+            "context_chunks": retrieval["retrieved_context"],
+            "chunk_hashes": retrieval["chunk_hashes"],
+            "query_embedding": retrieval["query_embedding"],
+            "trace_id": retrieval["trace_id"]
+        }, trace_id=retrieval["trace_id"])
+
+    def answer_batch(self, questions: List[str], max_in_flight: int = 4,
+                     batch_size: int = 64) -> Iterator[Tuple[int, dict, Union[dict, Exception]]]:
+        """
+        Retrieves and answers `questions`, with at most `max_in_flight` LLM calls
+        outstanding. The next retrieval batch runs while earlier answers are
+        generated. Yields (question index, retrieval result, GENERATE_RESPONSE
+        payload or the exception it failed with) in completion order.
+        """
+        slots = threading.BoundedSemaphore(max_in_flight)
+        finished = queue.Queue()
+        submitted = yielded = 0
+        for start in range(0, len(questions), batch_size):
+            for offset, retrieval in enumerate(self.retrieve(questions[start:start + batch_size], batch_size)):
+                slots.acquire()
+                future = self.generate(retrieval)
+                future.add_done_callback(
+                    lambda f, i=start + offset, r=retrieval: (slots.release(), finished.put((i, r, f)))
+                )
+                submitted += 1
+                while not finished.empty():
+                    yield self._outcome(finished.get())
+                    yielded += 1
+        while yielded < submitted:
+            yield self._outcome(finished.get())
+            yielded += 1
+
+    @staticmethod
+    def _outcome(item: tuple) -> tuple:
+        i, retrieval, future = item
+        error = future.exception()
+        return i, retrieval, future.result() if error is None else error
+
+    def shutdown(self, timeout: Optional[float] = None):
+        self.coordinator.shutdown(timeout)
+        self.retrieval_agent.wait_for_background_work(timeout)
@@ -0,0 +1,192 @@
+import os
+import math
+import faiss
+import numpy as np
+from typing import Literal, Optional
+from pydantic import BaseModel
+
+IndexKind = Literal["flat", "ivf", "hnsw"]
+VectorStorage = Literal["float32", "float16", "sq8", "pq"]
+# Quantizers below this many vectors cannot be trained reliably; stay on float32
+MIN_QUANTIZER_TRAINING = 10_000
+
+
+class IndexPolicy(BaseModel):
+    """
+    Decides which FAISS index backs the vector store.
+
+    Small corpora stay on an exact `IndexFlatL2`. Once `ntotal` passes
+    `upgrade_threshold` the flat index is rebuilt as the approximate `kind`
+    (IVF or HNSW); `nprobe` and `ef_search` trade recall for query latency.
+
+    `storage` compresses the stored vectors from 4 bytes per dimension to 2
+    (float16), 1 (sq8) or `pq_m` bytes per vector (product quantization).
+    Compressed indexes return a `rerank_factor` times longer shortlist, which
+    `search` re-ranks exactly against the full-precision vectors the store
+    keeps memory-mapped on disk.
+    """
+    kind: IndexKind = "hnsw"
+    storage: VectorStorage = "float32"
+    upgrade_threshold: int = 200_000
+    # IVF
+    nlist: Optional[int] = None
+    nprobe: int = 16
+    # HNSW
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    # Compressed storage
+    pq_m: int = 48
+    rerank: bool = True
+    rerank_factor: int = 4
+
+    @classmethod
+    def from_env(cls) -> "IndexPolicy":
+        """Builds a policy from RAG_INDEX_* environment variables, falling back to defaults."""
+        overrides = {
+            "kind": os.environ.get("RAG_INDEX_KIND"),
+            "upgrade_threshold": os.environ.get("RAG_INDEX_UPGRADE_THRESHOLD"),
+            "nlist": os.environ.get("RAG_INDEX_NLIST"),
+            "nprobe": os.environ.get("RAG_INDEX_NPROBE"),
+            "hnsw_m": os.environ.get("RAG_INDEX_HNSW_M"),
+            "ef_search": os.environ.get("RAG_INDEX_EF_SEARCH"),
+            "storage": os.environ.get("RAG_INDEX_STORAGE"),
+            "pq_m": os.environ.get("RAG_INDEX_PQ_M"),
+            "rerank": os.environ.get("RAG_INDEX_RERANK"),
+            "rerank_factor": os.environ.get("RAG_INDEX_RERANK_FACTOR"),
+        }
+        return cls(**{k: v for k, v in overrides.items() if v is not None})
+
+    def should_upgrade(self, index) -> bool:
+        threshold = self.upgrade_threshold
+        if self.kind == "flat" and self.storage in ("sq8", "pq"):
+            # build_index stays on a plain flat index until the quantizer can be trained
+            threshold = max(threshold, MIN_QUANTIZER_TRAINING)
+        return (
+            index is not None
+            and (self.kind != "flat" or self.storage != "float32")
+            and describe_index(index) == "flat"
+            and index.ntotal >= threshold
+        )
+
+    def nlist_for(self, ntotal: int) -> int:
+        if self.nlist:
+            return self.nlist
+        # Common rule of thumb: ~4 * sqrt(N) lists, each with enough points to train.
+        return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+    def pq_m_for(self, dim: int) -> int:
+        """The largest sub-quantizer count <= pq_m that divides `dim`."""
+        return next(m for m in range(min(self.pq_m, dim), 0, -1) if dim % m == 0)
+
+    def _compressed_index(self, vectors: np.ndarray):
+        dim = vectors.shape[1]
+        codes = {"float16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{self.pq_m_for(dim)}"}[self.storage]
+        prefix = {"flat": "", "ivf": f"IVF{self.nlist_for(len(vectors))},", "hnsw": f"HNSW{self.hnsw_m},"}[self.kind]
+        index = faiss.index_factory(dim, prefix + codes)
+        if self.kind == "hnsw":
+            index.hnsw.efConstruction = self.ef_construction
+        index.train(vectors)
+        return index
+
+    def build_index(self, vectors: np.ndarray):
+        """Creates (and trains, if needed) an index of `kind` and `storage` holding `vectors`."""
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        dim = vectors.shape[1]
+        if self.storage != "float32" and (self.storage == "float16" or len(vectors) >= MIN_QUANTIZER_TRAINING):
+            index = self._compressed_index(vectors)
+        elif self.kind == "flat":
+            index = faiss.IndexFlatL2(dim)
+        elif self.kind == "ivf":
+            quantizer = faiss.IndexFlatL2(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, self.nlist_for(len(vectors)))
+            index.train(vectors)
+        elif self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            raise ValueError(f"Unsupported index kind: {self.kind}")
+        index.add(vectors)
+        self.configure_search(index)
+        return index
+
+    def configure_search(self, index):
+        """Applies the query-time knobs; these are not stored in the index file."""
+        kind, _ = parse_index_type(describe_index(index))
+        if kind == "ivf":
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif kind == "hnsw":
+            index.hnsw.efSearch = self.ef_search
+
+    def rebuild(self, index, vectors: np.ndarray):
+        """Builds a fresh index of the same type as `index` holding `vectors`."""
+        kind, storage = parse_index_type(describe_index(index))
+        if (kind == "flat" and storage == "float32") or len(vectors) == 0:
+            rebuilt = faiss.IndexFlatL2(index.d)
+            rebuilt.add(np.ascontiguousarray(vectors, dtype="float32"))
+            return rebuilt
+        return self.model_copy(update={"kind": kind, "storage": storage}).build_index(vectors)
+
+    def search(self, index, queries: np.ndarray, k: int, full_vectors=None):
+        """
+        `index.search`, plus exact re-ranking for compressed indexes: the top
+        `k * rerank_factor` candidates by code distance are re-scored against
+        `full_vectors` (row-indexable by position) and the best k are returned.
+        """
+        if not (self.rerank and is_compressed(index) and full_vectors is not None
+                and len(full_vectors) >= index.ntotal):
+            return index.search(queries, k)
+        _, candidates = index.search(queries, min(k * self.rerank_factor, index.ntotal))
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        ids = np.full((len(queries), k), -1, dtype="int64")
+        for row, (query, shortlist) in enumerate(zip(queries, candidates)):
+            shortlist = shortlist[shortlist >= 0]
+            exact = ((np.asarray(full_vectors[shortlist], dtype="float32") - query) ** 2).sum(axis=1)
+            best = np.argsort(exact, kind="stable")[:k]
+            distances[row, :len(best)] = exact[best]
+            ids[row, :len(best)] = shortlist[best]
+        return distances, ids
+
+
+def _vector_storage(index) -> str:
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "float16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return "float32"
+
+
+def describe_index(index) -> str:
+    """
+    Returns the index type name recorded in the store manifest: the kind,
+    plus "+<storage>" for compressed vectors (e.g. "hnsw+sq8").
+    """
+    if isinstance(index, faiss.IndexHNSW):
+        kind = "hnsw"
+    elif isinstance(index, faiss.IndexIVF):
+        kind = "ivf"
+    elif isinstance(index, (faiss.IndexFlat, faiss.IndexScalarQuantizer, faiss.IndexPQ)):
+        kind = "flat"
+    else:
+        return type(index).__name__
+    storage = _vector_storage(index)
+    return kind if storage == "float32" else f"{kind}+{storage}"
+
+
+def parse_index_type(index_type: str):
+    """Splits a `describe_index` name into (kind, storage)."""
+    kind, _, storage = index_type.partition("+")
+    return kind, storage or "float32"
+
+
+def is_compressed(index) -> bool:
+    return index is not None and parse_index_type(describe_index(index))[1] != "float32"
+
+
+def reconstruct_all(index, start: int = 0) -> np.ndarray:
+    """Returns every stored vector from position `start` on, in id order."""
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(start, index.ntotal - start)
@@ -0,0 +1,172 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """Streams a file through SHA-256 so large uploads are never held in memory."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_chunk(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IngestionLedger:
+    """
+    Content-addressed record of what has been ingested.
+
+    Keeps, per source file name, the hash of the file and the hashes of the
+    chunks it produced, plus a reverse map from file hash to the sources that
+    hold that content. The IngestionAgent uses it to skip unchanged or
+    duplicate files and to diff the chunks of a changed file against the
+    previous version, so only new chunks are embedded and stale ones dropped.
+
+    An ingest's records are staged while its batches are on their way and
+    only committed (and saved) once the RetrievalAgent has stored them all;
+    lookups already see staged records, so a file uploaded again meanwhile is
+    diffed against the version in flight. An aborted ingest's records are
+    dropped.
+    """
+    def __init__(self, ledger_path: str = "ingestion_ledger.json"):
+        self.ledger_path = ledger_path
+        self._lock = threading.Lock()
+        self.sources: Dict[str, dict] = {}
+        self.files: Dict[str, List[str]] = {}
+        # ingest_id -> [(source, file_hash, chunk_hashes)], in staging order
+        self.staged: Dict[str, list] = {}
+        if os.path.exists(ledger_path):
+            try:
+                with open(ledger_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.sources = data.get("sources", {})
+                self.files = data.get("files", {})
+            except Exception as e:
+                print(f"[IngestionLedger] Failed to load ledger, starting empty: {e}")
+
+    def _entry(self, source: str) -> Optional[dict]:
+        """The source's latest staged record, else its committed one; callers hold the lock."""
+        for updates in reversed(list(self.staged.values())):
+            for staged_source, file_hash, chunk_hashes in reversed(updates):
+                if staged_source == source:
+                    return {"file_hash": file_hash, "chunk_hashes": chunk_hashes}
+        return self.sources.get(source)
+
+    def sources_with_content(self, file_hash: str) -> List[str]:
+        """Returns the sources already ingested (or being ingested) with exactly this content."""
+        with self._lock:
+            candidates = list(self.files.get(file_hash, []))
+            for updates in self.staged.values():
+                candidates.extend(source for source, staged_hash, _ in updates
+                                  if staged_hash == file_hash and source not in candidates)
+            return [source for source in candidates if self._entry(source)["file_hash"] == file_hash]
+
+    def chunk_hashes(self, source: str) -> List[str]:
+        with self._lock:
+            entry = self._entry(source)
+            return list(entry["chunk_hashes"]) if entry else []
+
+    def stage(self, ingest_id: str, updates: List[tuple]):
+        """Holds an ingest's `(source, file_hash, chunk_hashes)` records until `commit` or `abort`."""
+        with self._lock:
+            self.staged[ingest_id] = list(updates)
+
+    def commit(self, ingest_id: str) -> List[str]:
+        """Records a staged ingest once all its chunks are stored; returns the aliases this dropped."""
+        with self._lock:
+            updates = self.staged.pop(ingest_id, [])
+            dropped = []
+            for source, file_hash, chunk_hashes in updates:
+                dropped.extend(self._record(source, file_hash, chunk_hashes))
+            if updates:
+                self._save()
+            return dropped
+
+    def abort(self, ingest_id: str) -> List[str]:
+        """Drops a staged ingest; returns the sources it would have recorded."""
+        with self._lock:
+            return [source for source, _, _ in self.staged.pop(ingest_id, [])]
+
+    def record(self, source: str, file_hash: str, chunk_hashes: List[str]) -> List[str]:
+        with self._lock:
+            dropped = self._record(source, file_hash, chunk_hashes)
+            self._save()
+            return dropped
+
+    def _record(self, source: str, file_hash: str, chunk_hashes: List[str]) -> List[str]:
+        """
+        Callers hold the lock. When the source's content changes, its old
+        chunks are dropped from the index, so aliases that were only indexed
+        through them are dropped too (and ingested in full if re-uploaded);
+        returns those aliases.
+        """
+        dropped = []
+        previous = self.sources.get(source)
+        if previous and previous["file_hash"] != file_hash:
+            self._unlink(previous["file_hash"], source)
+            if previous["chunk_hashes"]:
+                dropped = self._drop_orphaned_aliases(previous["file_hash"])
+        self.sources[source] = {"file_hash": file_hash, "chunk_hashes": chunk_hashes}
+        holders = self.files.setdefault(file_hash, [])
+        if source not in holders:
+            holders.append(source)
+        return dropped
+
+    def _drop_orphaned_aliases(self, file_hash: str) -> List[str]:
+        holders = self.files.get(file_hash, [])
+        if any(self.sources.get(holder, {}).get("chunk_hashes") for holder in holders):
+            return []
+        for holder in holders:
+            self.sources.pop(holder, None)
+        self.files.pop(file_hash, None)
+        return list(holders)
+
+    def forget(self, sources: List[str]) -> List[str]:
+        """
+        Removes sources, so the same content is ingested again if re-uploaded.
+        Aliases whose content was only embedded under a removed source are
+        removed with it; returns every source that was removed.
+        """
+        with self._lock:
+            removed = []
+            pending = list(sources)
+            while pending:
+                source = pending.pop(0)
+                entry = self.sources.pop(source, None)
+                if entry is None:
+                    continue
+                removed.append(source)
+                self._unlink(entry["file_hash"], source)
+                holders = self.files.get(entry["file_hash"], [])
+                if entry["chunk_hashes"] and not any(self.sources.get(h, {}).get("chunk_hashes") for h in holders):
+                    pending.extend(holders)
+            if removed:
+                self._save()
+            return removed
+
+    def _unlink(self, file_hash: str, source: str):
+        holders = self.files.get(file_hash, [])
+        if source in holders:
+            holders.remove(source)
+        if not holders:
+            self.files.pop(file_hash, None)
+
+    def _save(self):
+        tmp_path = self.ledger_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": self.sources, "files": self.files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.ledger_path)
@@ -0,0 +1,138 @@
+import os
+import re
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+# Words plus joined identifiers such as "err-404", "v2.3.1" or "10.0.0.1"
+TOKEN_RE = re.compile(r"\w+(?:[-./:#]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased tokens; compound identifiers are kept whole and also split into parts."""
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[-./:#_]", token) if part)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    A compact, incrementally maintained inverted index with BM25 scoring.
+
+    Documents are addressed by the same positions as the FAISS index and the
+    chunk list, and are only ever appended; deleted positions are filtered at
+    query time via `exclude`. Postings are kept as `array('I')` pairs (doc,
+    term frequency) so memory stays close to 8 bytes per posting.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_lengths = array("I")
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, texts: Iterable[str]):
+        """Indexes `texts` at the next positions, in order."""
+        for text in texts:
+            position = len(self.doc_lengths)
+            tokens = tokenize(text)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                entry = self.postings.get(token)
+                if entry is None:
+                    entry = self.postings[token] = (array("I"), array("I"))
+                entry[0].append(position)
+                entry[1].append(tf)
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+    def search(self, query: str, k: int, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """Returns up to k (position, bm25_score) pairs, best first."""
+        n_docs = len(self.doc_lengths)
+        if not n_docs or k <= 0:
+            return []
+        doc_lengths = np.frombuffer(self.doc_lengths, dtype=np.uint32)
+        avg_length = self.total_length / n_docs or 1.0
+        scores = np.zeros(n_docs, dtype="float32")
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            docs = np.frombuffer(entry[0], dtype=np.uint32)
+            tfs = np.frombuffer(entry[1], dtype=np.uint32).astype("float32")
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / avg_length)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        excluded = np.fromiter(exclude, dtype="int64")
+        if len(excluded):
+            scores[excluded[excluded < n_docs]] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+    # --- persistence (numpy arrays only, no pickle) ---
+
+    def save(self, path: str, epoch: int):
+        terms = list(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self.postings[term][0])
+        docs = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint32)
+        for i, term in enumerate(terms):
+            docs[offsets[i]:offsets[i + 1]] = self.postings[term][0]
+            tfs[offsets[i]:offsets[i + 1]] = self.postings[term][1]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                offsets=offsets,
+                docs=docs,
+                tfs=tfs,
+                doc_lengths=np.frombuffer(self.doc_lengths, dtype=np.uint32),
+                header=np.array([epoch, self.total_length], dtype="int64"),
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple[Optional["KeywordIndex"], Optional[int]]:
+        """Returns (index, epoch), or (None, None) if there is no saved index."""
+        if not os.path.exists(path):
+            return None, None
+        with np.load(path, allow_pickle=False) as data:
+            index = cls()
+            raw_terms = data["terms"].tobytes().decode("utf-8")
+            terms = raw_terms.split("\n") if raw_terms else []
+            offsets, docs, tfs = data["offsets"], data["docs"], data["tfs"]
+            for i, term in enumerate(terms):
+                start, stop = offsets[i], offsets[i + 1]
+                index.postings[term] = (array("I", docs[start:stop].tobytes()), array("I", tfs[start:stop].tobytes()))
+            index.doc_lengths = array("I", data["doc_lengths"].tobytes())
+            epoch, index.total_length = (int(v) for v in data["header"])
+        return index, epoch
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[int]], weights: List[float], k: int = 60) -> List[int]:
+    """Fuses ranked position lists: score = sum(weight / (k + rank)), best first."""
+    scores: Dict[int, float] = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        if not weight:
+            continue
+        for rank, position in enumerate(ranked, 1):
+            scores[position] = scores.get(position, 0.0) + weight / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
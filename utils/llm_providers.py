@@ -0,0 +1,96 @@
+import os
+import time
+import random
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, Optional
+
+# google.api_core exceptions worth retrying, matched by name so no import is needed
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable",
+    "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+}
+
+
+class TransientLLMError(Exception):
+    """A provider error that is expected to go away when the call is retried."""
+    pass
+
+
+class RateLimitError(TransientLLMError):
+    pass
+
+
+def is_transient(error: BaseException) -> bool:
+    return (isinstance(error, (TransientLLMError, ConnectionError, TimeoutError))
+            or type(error).__name__ in TRANSIENT_ERROR_NAMES)
+
+
+class LLMProvider(ABC):
+    """Interface the LLMResponseAgent uses to talk to a language model."""
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """Returns the full completion for `prompt`."""
+        pass
+
+    @abstractmethod
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yields the completion for `prompt` in pieces as they are produced."""
+        pass
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through `google.generativeai`."""
+    def __init__(self, model_name: str = 'gemini-2.5-flash'):
+        import google.generativeai as genai
+        try:
+            genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        except Exception as e:
+            raise Exception("GOOGLE_API_KEY not found. Please set it in your .env file.") from e
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeStreamingProvider(LLMProvider):
+    """
+    Local stand-in for tests and benchmarks: answers with a fixed text,
+    streamed word by word after a simulated time-to-first-token and
+    per-token delay. With `rate_limit_rate` that fraction of calls fails with
+    RateLimitError before the first token (`seed` makes the failures repeatable).
+    """
+    def __init__(self, answer: str = "This is a fake answer from the local provider.",
+                 first_token_delay: float = 0.0, token_delay: float = 0.0,
+                 rate_limit_rate: float = 0.0, seed: Optional[int] = None):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.rate_limit_rate = rate_limit_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+
+    def generate(self, prompt: str) -> str:
+        return "".join(self.stream(prompt))
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        with self._lock:
+            self.calls += 1
+            limited = self._random.random() < self.rate_limit_rate
+            self.rate_limited += limited
+        words = self.answer.split(" ")
+        time.sleep(self.first_token_delay)
+        if limited:
+            raise RateLimitError("429 Resource has been exhausted (simulated)")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
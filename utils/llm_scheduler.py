@@ -0,0 +1,170 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional
+from utils.llm_providers import LLMProvider, is_transient
+from utils.tracing import tracer, registry
+
+
+class LLMTimeoutError(TimeoutError):
+    pass
+
+
+class _Call:
+    """One provider call and the pieces it has produced so far, shared by every caller waiting on it."""
+    def __init__(self, prompt: str, deadline: Optional[float]):
+        self.prompt = prompt
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+        self.cancelled = False
+        self._cond = threading.Condition()
+
+    def add(self, piece: str):
+        with self._cond:
+            self.pieces.append(piece)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def follow(self, deadline: Optional[float]) -> Iterator[str]:
+        """Yields every piece from the first one on, raising the call's error or LLMTimeoutError at `deadline`."""
+        seen = 0
+        while True:
+            with self._cond:
+                while seen == len(self.pieces) and not self.done:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise LLMTimeoutError("LLM call exceeded its deadline")
+                    self._cond.wait(remaining)
+                new = self.pieces[seen:]
+                done, error = self.done, self.error
+            seen += len(new)
+            yield from new
+            if done and not new:
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMScheduler:
+    """
+    Sits between the LLMResponseAgent and the provider.
+
+    At most `max_concurrent` provider calls run at once, on the scheduler's
+    own threads; further prompts queue. A prompt identical to one already in
+    flight joins that call instead of starting another, and every caller gets
+    the full stream. Transient errors (rate limits, unavailable, timeouts)
+    are retried up to `max_retries` times with full-jitter exponential
+    backoff, as long as nothing was streamed yet. Each caller waits at most
+    `timeout` seconds from submission, queueing included, and gets
+    LLMTimeoutError after that; a call whose callers have all given up stops
+    reading from the provider and is not retried.
+    """
+    def __init__(self, provider: LLMProvider, max_concurrent: int = 4, max_retries: int = 3,
+                 timeout: Optional[float] = 60.0, backoff: float = 0.5, max_backoff: float = 8.0):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._in_flight: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="llm-call")
+        self._random = random.Random()
+
+    @classmethod
+    def from_env(cls, provider: LLMProvider) -> "LLMScheduler":
+        timeout = float(os.environ.get("RAG_LLM_TIMEOUT", 60))
+        return cls(
+            provider,
+            max_concurrent=int(os.environ.get("RAG_LLM_MAX_CONCURRENT", 4)),
+            max_retries=int(os.environ.get("RAG_LLM_MAX_RETRIES", 3)),
+            timeout=timeout if timeout > 0 else None,
+            backoff=float(os.environ.get("RAG_LLM_BACKOFF", 0.5)),
+        )
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yields the completion for `prompt` in pieces; `timeout` overrides the scheduler's."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        call = self._join(prompt, deadline)
+        try:
+            yield from call.follow(deadline)
+        except LLMTimeoutError:
+            registry.inc("rag_llm_calls_total", result="timeout")
+            raise
+        finally:
+            self._leave(call)
+
+    def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        return "".join(self.stream(prompt, timeout))
+
+    def _join(self, prompt: str, deadline: Optional[float]) -> _Call:
+        with self._lock:
+            call = self._in_flight.get(prompt)
+            if call is None:
+                call = self._in_flight[prompt] = _Call(prompt, deadline)
+                self._pool.submit(self._run, call)
+            else:
+                registry.inc("rag_llm_coalesced_total")
+                print(f"[LLMScheduler] Joined an identical in-flight call ({call.waiters} waiting).")
+                # The call keeps retrying for as long as any caller still waits
+                call.deadline = None if deadline is None or call.deadline is None else max(call.deadline, deadline)
+            call.waiters += 1
+            return call
+
+    def _leave(self, call: _Call):
+        with self._lock:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.done:
+                call.cancelled = True
+                if self._in_flight.get(call.prompt) is call:
+                    del self._in_flight[call.prompt]
+
+    def _delay(self, attempt: int) -> float:
+        return self._random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def _run(self, call: _Call):
+        tracer.record("llm_queue_wait", time.monotonic() - call.submitted)
+        error = None
+        attempt = 0
+        while not call.cancelled:
+            try:
+                for piece in self.provider.stream(call.prompt):
+                    if call.cancelled:
+                        break
+                    call.add(piece)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                attempt += 1
+                delay = self._delay(attempt)
+                # A partly streamed answer cannot be retried without repeating text
+                if (call.pieces or not is_transient(e) or attempt > self.max_retries
+                        or (call.deadline is not None and time.monotonic() + delay >= call.deadline)):
+                    break
+                registry.inc("rag_llm_retries_total", error=type(e).__name__)
+                print(f"[LLMScheduler] {type(e).__name__}: retrying in {delay:.2f}s "
+                      f"(attempt {attempt} of {self.max_retries}).")
+                time.sleep(delay)
+        with self._lock:
+            if self._in_flight.get(call.prompt) is call:
+                del self._in_flight[call.prompt]
+        if not call.cancelled:
+            registry.inc("rag_llm_calls_total", result="error" if error else "ok")
+        call.finish(error)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
@@ -3,17 +3,24 @@ from typing import Dict, Any, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 # Define literal types for type safety and clarity
-SenderType = Literal["UI", "Coordinator", "IngestionAgent", "RetrievalAgent", "LLMResponseAgent"]
-ReceiverType = Literal["Coordinator", "IngestionAgent", "RetrievalAgent", "LLMResponseAgent", "UI"]
+SenderType = Literal["UI", "Coordinator", "IngestionAgent", "EmbeddingAgent", "RetrievalAgent", "LLMResponseAgent"]
+ReceiverType = Literal["Coordinator", "IngestionAgent", "EmbeddingAgent", "RetrievalAgent", "LLMResponseAgent", "UI"]
 MessageType = Literal[
     "INGEST_REQUEST",
     "INGEST_COMPLETE",
+    "INGEST_FAILED",
     "EMBED_REQUEST",
     "EMBED_COMPLETE",
     "RETRIEVAL_REQUEST",
     "RETRIEVAL_RESPONSE",
+    "BATCH_RETRIEVAL_REQUEST",
+    "BATCH_RETRIEVAL_RESPONSE",
     "GENERATE_REQUEST",
-    "GENERATE_RESPONSE"
+    "GENERATE_PARTIAL",
+    "GENERATE_RESPONSE",
+    "CACHE_INVALIDATE",
+    "DELETE_REQUEST",
+    "DELETE_COMPLETE"
 ]
 
 class MCPPayload(BaseModel):
@@ -23,9 +30,30 @@ class MCPPayload(BaseModel):
 class IngestRequestPayload(MCPPayload):
     file_paths: List[str]
 
+class IngestFailedPayload(MCPPayload):
+    # The ingest's remaining batches are dropped and its files removed
+    ingest_id: str
+    error: str
+    # Set when the step that failed was one of the ingest's batches
+    batch_index: Optional[int] = None
+
 class EmbedRequestPayload(MCPPayload):
     chunks: List[str]
     metadata: List[Dict[str, Any]]
+    # source -> hashes of chunks the new version of that file no longer contains
+    stale_chunks: Dict[str, List[str]] = {}
+    # Ingests are streamed as several bounded batches; the last one is marked final
+    ingest_id: Optional[str] = None
+    batch_index: int = 0
+    final: bool = False
+    total_batches: Optional[int] = None
+    # On hops to worker processes only `chunks` and this handle are sent; the
+    # rest of the payload waits in the Coordinator's ChunkBuffer
+    chunk_ref: Optional[str] = None
+
+class EmbedCompletePayload(EmbedRequestPayload):
+    # float32 array of shape (len(chunks), dim), or None for a batch without chunks
+    embeddings: Any = None
 
 class RetrievalRequestPayload(MCPPayload):
     query: str
@@ -33,10 +61,41 @@ class RetrievalRequestPayload(MCPPayload):
 class RetrievalResponsePayload(MCPPayload):
     query: str
     retrieved_context: List[str]
+    # Hashes of every chunk in the (possibly merged) context spans
+    chunk_hashes: List[str] = []
+    query_embedding: Optional[List[float]] = None
+    # Estimated prompt tokens of retrieved_context
+    context_tokens: Optional[int] = None
+
+class BatchRetrievalRequestPayload(MCPPayload):
+    queries: List[str]
+    # One per query, echoed in its result; generated when omitted
+    trace_ids: List[str] = []
+
+class BatchRetrievalResponsePayload(MCPPayload):
+    # One RetrievalResponsePayload (plus its trace_id) per query, in request order
+    results: List[Dict[str, Any]]
 
 class GenerateRequestPayload(MCPPayload):
     query: str
     context_chunks: List[str]
+    # Used by the semantic answer cache; both come from the retrieval step
+    chunk_hashes: List[str] = []
+    query_embedding: Optional[List[float]] = None
+
+class CacheInvalidatePayload(MCPPayload):
+    chunk_hashes: List[str]
+
+class DeleteRequestPayload(MCPPayload):
+    # Every chunk of these sources is removed from the index
+    sources: List[str]
+
+class DeleteCompletePayload(MCPPayload):
+    sources: List[str]
+    deleted_chunks: int
+
+class GeneratePartialPayload(MCPPayload):
+    delta: str
 
 class GenerateResponsePayload(MCPPayload):
     answer: str
@@ -52,5 +111,9 @@ class MCPMessage(BaseModel):
     trace_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     payload: Dict[str, Any]
 
+    def fields(self) -> dict:
+        """The message's fields, sharing the payload; `model_dump` would deep-copy every chunk."""
+        return self.__dict__.copy()
+
     def to_dict(self):
         return self.model_dump()
\ No newline at end of file
@@ -0,0 +1,133 @@
+import os
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+from utils.document_parser import iter_document_pages, iter_pdf_pages, count_pdf_pages
+
+
+def _parse_range(file_path: str, start: Optional[int], stop: Optional[int]) -> List[str]:
+    """Worker entry point: parses a whole file, or a page range of a PDF."""
+    if start is None:
+        return list(iter_document_pages(file_path))
+    return list(iter_pdf_pages(file_path, start, stop))
+
+
+class ParsingEngine:
+    """
+    Parses documents in parallel on a process pool.
+
+    Large PDFs are cut into page ranges of `pdf_pages_per_task` so a single
+    big file is spread over several cores. At most `2 * max_workers` ranges
+    are outstanding at a time, and more are submitted as the caller consumes
+    pages, so parsed pages never pile up in memory ahead of the caller.
+    `parse` hands back files in order, each with a generator that yields
+    pages as soon as the range holding them is done, so the caller can split
+    and embed the first pages while later ones are still parsing.
+    """
+    def __init__(self, max_workers: Optional[int] = None, pdf_pages_per_task: int = 20):
+        self.max_workers = os.cpu_count() if max_workers is None else max_workers
+        self.pdf_pages_per_task = pdf_pages_per_task
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the UI process is multi-threaded
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _plan(self, file_path: str) -> List[Tuple[Optional[int], Optional[int]]]:
+        if file_path.lower().endswith(".pdf"):
+            n_pages = count_pdf_pages(file_path)
+            if n_pages > self.pdf_pages_per_task:
+                return [(start, start + self.pdf_pages_per_task)
+                        for start in range(0, n_pages, self.pdf_pages_per_task)]
+        return [(None, None)]
+
+    def parse(self, file_paths: List[str]) -> Iterator[Tuple[str, Iterator[str]]]:
+        """
+        Yields `(file_path, pages)` for every file. Parse errors are raised
+        from the `pages` generator, so callers handle them per file. A file's
+        pages must be consumed before the next file is taken; whatever is
+        left of them is dropped.
+        """
+        if not self.max_workers:
+            for path in file_paths:
+                yield path, iter_document_pages(path)
+            return
+
+        executor = self._get_executor()
+        tasks = self._tasks(file_paths)
+        # (file number, future, error) per range, in submission order
+        window: Deque[tuple] = deque()
+        current = [0]
+
+        def fill():
+            while len(window) < 2 * self.max_workers:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                number, path, start, stop, error = task
+                if number < current[0]:
+                    continue
+                if error is None:
+                    try:
+                        window.append((number, executor.submit(_parse_range, path, start, stop), None))
+                    except Exception as e:
+                        window.append((number, None, e))
+                else:
+                    window.append((number, None, error))
+
+        try:
+            for number, path in enumerate(file_paths):
+                current[0] = number
+                while window and window[0][0] < number:
+                    future = window.popleft()[1]
+                    if future is not None:
+                        future.cancel()
+                yield path, self._iter_results(number, window, fill, current)
+        finally:
+            for _, future, _ in window:
+                if future is not None:
+                    future.cancel()
+
+    def _tasks(self, file_paths: List[str]) -> Iterator[tuple]:
+        """Plans files lazily, as their ranges are about to be submitted."""
+        for number, path in enumerate(file_paths):
+            try:
+                plan = self._plan(path)
+            except Exception as e:
+                yield number, path, None, None, e
+                continue
+            for start, stop in plan:
+                yield number, path, start, stop, None
+
+    def _iter_results(self, number: int, window: Deque[tuple], fill: Callable[[], None],
+                      current: List[int]) -> Iterator[str]:
+        try:
+            while True:
+                if current[0] != number:
+                    raise RuntimeError("Pages must be consumed before the next file is taken.")
+                fill()
+                if not window or window[0][0] != number:
+                    return
+                _, future, error = window.popleft()
+                if error is not None:
+                    raise error
+                yield from future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. a parser segfault); start a fresh pool for the next request
+            self._executor = None
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
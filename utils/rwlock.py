@@ -0,0 +1,59 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """
+    A reader-writer lock: any number of readers, or one writer.
+
+    Writers are preferred: once a writer is waiting, new readers queue behind
+    it, so a steady stream of searches cannot starve ingestion. The writing
+    thread may re-enter `write()` and may take `read()` while it holds the
+    write lock; upgrading a read lock to a write lock is not supported.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                owned = True
+            else:
+                owned = False
+                self._cond.wait_for(lambda: self._writer is None and not self._waiting_writers)
+                self._readers += 1
+        try:
+            yield
+        finally:
+            if not owned:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting_writers += 1
+                try:
+                    self._cond.wait_for(lambda: self._writer is None and not self._readers)
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+            self._write_depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._write_depth -= 1
+                if not self._write_depth:
+                    self._writer = None
+                    self._cond.notify_all()
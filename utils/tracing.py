@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Seconds; chosen to cover a FAISS search (sub-ms) up to a slow LLM call.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bucket bound holding the q-th observation (bucket resolution)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """In-process counters and histograms, keyed by metric name and labels."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = _Histogram(self.buckets)
+            series[key].observe(value)
+
+    def snapshot(self) -> dict:
+        """A JSON-friendly view: counter values and histogram count/sum/p50/p99."""
+        with self._lock:
+            counters = {
+                name: {_format_labels(k) or "{}": v for k, v in series.items()}
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: {
+                    _format_labels(k) or "{}": {
+                        "count": h.count, "sum": h.sum, "p50": h.quantile(0.5), "p99": h.quantile(0.99)
+                    }
+                    for k, h in series.items()
+                }
+                for name, series in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {h.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+class JsonlSink:
+    """Appends one JSON object per finished span to a file."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    """
+    Records timed spans (parse, encode, search, LLM call, ...) tied together
+    by the MCP trace_id. Every span feeds the `rag_stage_seconds` histogram;
+    the most recent traces are kept in memory so one slow answer can be
+    broken down with `get_trace`, and spans are optionally written to JSONL.
+    """
+    def __init__(self, registry: MetricsRegistry, max_traces: int = 1000):
+        self.registry = registry
+        self.max_traces = max_traces
+        self.sink: Optional[JsonlSink] = None
+        self._traces: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, trace_id: Optional[str] = None, **attrs):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.record(stage, time.perf_counter() - start, trace_id, **attrs)
+
+    def record(self, stage: str, duration: float, trace_id: Optional[str] = None, **attrs):
+        """Records a span whose duration was measured by the caller."""
+        self.registry.observe("rag_stage_seconds", duration, stage=stage)
+        span = {"stage": stage, "trace_id": trace_id, "duration_ms": round(duration * 1000, 3), "ts": time.time()}
+        if attrs:
+            span["attrs"] = attrs
+        if trace_id:
+            with self._lock:
+                self._traces.setdefault(trace_id, []).append(span)
+                self._traces.move_to_end(trace_id)
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+        if self.sink is not None:
+            self.sink.write(span)
+
+    def get_trace(self, trace_id: str) -> List[dict]:
+        with self._lock:
+            return list(self._traces.get(trace_id, []))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.to_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serves the registry at http://host:port/metrics from a daemon thread (idempotent)."""
+    global _server
+    if _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"[Tracing] Serving Prometheus metrics on http://{host}:{port}/metrics")
+    return _server
+
+
+def configure_from_env():
+    """Enables the optional exporters: RAG_TRACE_JSONL=<path>, RAG_METRICS_PORT=<port>."""
+    jsonl_path = os.environ.get("RAG_TRACE_JSONL")
+    if jsonl_path and tracer.sink is None:
+        tracer.sink = JsonlSink(jsonl_path)
+    metrics_port = os.environ.get("RAG_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+
+
+# Process-wide instances used by the agents and the Coordinator
+registry = MetricsRegistry()
+tracer = Tracer(registry)
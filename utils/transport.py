@@ -0,0 +1,194 @@
+import atexit
+import pickle
+import itertools
+import threading
+import multiprocessing
+from typing import Callable, Dict, Optional
+from utils.mcp import MCPMessage
+from utils.tracing import registry
+
+# Frame kinds exchanged with a worker process
+_MESSAGE, _DONE, _ERROR = "message", "done", "error"
+
+
+def _dumps(frame) -> bytes:
+    # Protocol 5 keeps numpy payloads (e.g. embeddings) as raw buffers
+    return pickle.dumps(frame, protocol=5)
+
+
+def _worker_main(conn, factory: Callable, factory_kwargs: dict):
+    """
+    Entry point of a worker process: builds the agent and serves messages
+    from the Coordinator until told to stop or the pipe closes. Messages the agent
+    sends are framed back to the parent, which routes them.
+    """
+    send_lock = threading.Lock()
+
+    def send(frame):
+        data = _dumps(frame)
+        with send_lock:
+            conn.send_bytes(data)
+
+    agent = factory(lambda message: send((_MESSAGE, None, message.fields())), **factory_kwargs)
+    try:
+        while True:
+            try:
+                frame = pickle.loads(conn.recv_bytes())
+            except (EOFError, OSError):
+                return
+            if frame is None:
+                return
+            seq, message = frame
+            try:
+                agent.process_message(MCPMessage(**message))
+                send((_DONE, seq, None))
+            except Exception as e:
+                send((_ERROR, seq, f"{type(e).__name__}: {e}"))
+    finally:
+        # Lets the agent stop anything it started, e.g. a parser process pool
+        if hasattr(agent, "shutdown"):
+            agent.shutdown()
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.outstanding: Dict[int, tuple] = {}
+        self.send_lock = threading.Lock()
+        self.alive = True
+
+
+class ProcessAgentPool:
+    """
+    Runs one agent type as a pool of worker processes.
+
+    MCP messages are pickled (protocol 5) and sent over a `multiprocessing`
+    pipe, a Unix domain socket pair on POSIX. Each message goes to the
+    worker with the fewest in-flight messages, and at most `max_in_flight`
+    are in flight per worker, so a slow pool pushes back on its sender like
+    an inbox does. If a worker process dies, its in-flight messages are
+    retried once on a replacement process. After that `on_error` is called
+    with each of them. The Coordinator and the UI keep running.
+    """
+    def __init__(self, name: str, factory: Callable, processes: int,
+                 on_message: Callable[[MCPMessage], None],
+                 on_error: Callable[[MCPMessage, Exception], None],
+                 factory_kwargs: Optional[dict] = None, max_in_flight: int = 4,
+                 max_attempts: int = 2):
+        self.name = name
+        self.factory = factory
+        self.factory_kwargs = factory_kwargs or {}
+        self.on_message = on_message
+        self.on_error = on_error
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        # spawn, not fork: the UI process is multi-threaded
+        self._context = multiprocessing.get_context("spawn")
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._closed = False
+        self.workers = [self._start_worker(i) for i in range(processes)]
+        atexit.register(self.shutdown, 5)
+
+    def _start_worker(self, slot: int) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.factory, self.factory_kwargs),
+            name=f"{self.name}-process-{slot}",
+            # Not daemonic, so agents may start their own process pools (e.g. the
+            # IngestionAgent's parser); workers exit when their pipe closes.
+            daemon=False
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        threading.Thread(target=self._reader_loop, args=(slot, worker),
+                         name=f"{self.name}-reader-{slot}", daemon=True).start()
+        return worker
+
+    def dispatch(self, message: MCPMessage, attempt: int = 1):
+        """Sends `message` to the least busy worker; blocks while every worker is at `max_in_flight`."""
+        data = message.fields()
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or any(
+                w.alive and len(w.outstanding) < self.max_in_flight for w in self.workers))
+            if self._closed:
+                raise RuntimeError(f"{self.name} pool is shut down.")
+            worker = min((w for w in self.workers if w.alive), key=lambda w: len(w.outstanding))
+            seq = next(self._seq)
+            worker.outstanding[seq] = (message, attempt)
+        try:
+            with worker.send_lock:
+                worker.conn.send_bytes(_dumps((seq, data)))
+        except (OSError, ValueError):
+            # The reader thread notices the dead worker and retries its messages
+            pass
+
+    def _finish(self, worker: _Worker, seq: int) -> Optional[tuple]:
+        with self._cond:
+            entry = worker.outstanding.pop(seq, None)
+            self._cond.notify_all()
+        return entry
+
+    def _reader_loop(self, slot: int, worker: _Worker):
+        while True:
+            try:
+                kind, seq, data = pickle.loads(worker.conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            if kind == _MESSAGE:
+                try:
+                    self.on_message(MCPMessage(**data))
+                except Exception as e:
+                    print(f"[{self.name}] Failed to route message from worker {slot}: {e}")
+            elif kind == _DONE:
+                self._finish(worker, seq)
+            elif kind == _ERROR:
+                entry = self._finish(worker, seq)
+                if entry is not None:
+                    registry.inc("mcp_agent_errors_total", agent=self.name, type=entry[0].type)
+                    self.on_error(entry[0], RuntimeError(data))
+        self._handle_exit(slot, worker)
+
+    def _handle_exit(self, slot: int, worker: _Worker):
+        with self._cond:
+            worker.alive = False
+            lost = list(worker.outstanding.values())
+            worker.outstanding.clear()
+            closed = self._closed
+            if not closed:
+                worker.process.join(1)
+                print(f"[{self.name}] Worker process {slot} exited (code {worker.process.exitcode}); restarting it.")
+                registry.inc("mcp_worker_restarts_total", agent=self.name)
+                self.workers[slot] = self._start_worker(slot)
+            self._cond.notify_all()
+        if closed:
+            return
+        for message, attempt in lost:
+            if attempt < self.max_attempts:
+                try:
+                    self.dispatch(message, attempt + 1)
+                    continue
+                except Exception:
+                    pass
+            self.on_error(message, RuntimeError(f"{self.name} worker process crashed on {message.type}."))
+
+    def shutdown(self, timeout: Optional[float] = None):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self.workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send_bytes(_dumps(None))
+            except (OSError, ValueError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
@@ -0,0 +1,572 @@
+import os
+import json
+import pickle
+import threading
+from contextlib import contextmanager
+import faiss
+import numpy as np
+from typing import Iterable, List, Tuple, Optional, Any
+from utils.index_policy import describe_index, is_compressed
+from utils.chunk_store import ChunkFile, ChunkTable, InMemoryChunks, write_chunk_file
+
+MANIFEST_NAME = "manifest.json"
+# Files derived from the store (e.g. the keyword index) that orphan cleanup keeps
+SIDECAR_PREFIX = "sidecar_"
+
+
+def _fsync_dir(path: str):
+    """Flushes a directory entry so renames inside it survive a crash."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, write_fn):
+    """Writes a file via a temporary sibling and an atomic rename."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class VectorTable:
+    """
+    Full-precision vectors by index position: the base and segment `.npy`
+    files, memory-mapped and concatenated in order. Compressed indexes use
+    it to re-rank candidates exactly without holding float32 copies in RAM.
+    """
+    def __init__(self, parts=()):
+        self.parts = []
+        self._starts = []
+        self._length = 0
+        for part in parts:
+            self.add_part(part)
+
+    def add_part(self, vectors: np.ndarray):
+        if len(vectors):
+            self.parts.append(vectors)
+            self._starts.append(self._length)
+            self._length += len(vectors)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, positions) -> np.ndarray:
+        """Gathers the rows at an array of positions."""
+        positions = np.asarray(positions, dtype="int64")
+        part_ids = np.searchsorted(self._starts, positions, side="right") - 1
+        out = np.empty((len(positions), self.parts[0].shape[1] if self.parts else 0), dtype="float32")
+        for p in np.unique(part_ids):
+            mask = part_ids == p
+            out[mask] = self.parts[p][positions[mask] - self._starts[p]]
+        return out
+
+    def to_array(self) -> np.ndarray:
+        return np.concatenate(self.parts) if self.parts else np.empty((0, 0), dtype="float32")
+
+
+def _write_vectors(path: str, parts: List[np.ndarray]):
+    """Streams vector parts into one `.npy` file via a temporary sibling."""
+    total = sum(len(part) for part in parts)
+    tmp_path = path + ".tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype="float32", shape=(total, parts[0].shape[1]))
+    start = 0
+    for part in parts:
+        out[start:start + len(part)] = part
+        start += len(part)
+    out.flush()
+    del out
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SegmentStore:
+    """
+    Log-structured persistence for the FAISS index and its chunk metadata.
+
+    Every ingest appends a new segment (raw vectors + chunks) instead of
+    rewriting the whole index. The manifest is the single commit point: a
+    segment only exists once the manifest that lists it has been atomically
+    replaced, so a crash mid-write never leaves vectors and chunks out of sync.
+    Compaction is size-tiered and runs in a background thread: once
+    `compaction_threshold` adjacent segments of similar size have piled up
+    they are merged into one segment, and the segments are only folded into
+    a new base once they hold `base_fold_ratio` of the base's rows, so every
+    row is rewritten a logarithmic number of times rather than on every
+    compaction. `compact()` folds everything into the base on demand.
+
+    Chunks are stored in the columnar, memory-mapped format of
+    `utils.chunk_store`, so loading maps files instead of unpickling them.
+    `.pkl` chunk files written by older versions are still read, and are
+    replaced by the next compaction.
+
+    A compressed base index (SQ/PQ codes) is written together with a
+    full-precision `.npy` copy of its vectors; with the segments' vector
+    files it makes up `full_vectors()`, used for exact re-ranking.
+
+    Every chunk gets a stable id when it is appended. Ids ascend with
+    position and survive compaction and snapshots, which renumber positions,
+    so tombstones are recorded by id, in an append-only file the manifest
+    references; a delete appends to it instead of rewriting the manifest,
+    and each snapshot starts a new one. Segments store their first id (ids
+    within a segment are consecutive); a base or merged segment whose ids
+    have gaps keeps them in an `.ids.npy` file.
+    """
+    def __init__(self, store_dir: str = "faiss_store", compaction_threshold: int = 8,
+                 base_fold_ratio: float = 0.25, legacy_index_path: Optional[str] = None, legacy_meta_path: Optional[str] = None):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, MANIFEST_NAME)
+        self.compaction_threshold = compaction_threshold
+        self.base_fold_ratio = base_fold_ratio
+        self.legacy_index_path = legacy_index_path
+        self.legacy_meta_path = legacy_meta_path
+        self._lock = threading.Lock()
+        # Reentrant so write_snapshot can run inside pinned()
+        self._compaction_lock = threading.RLock()
+        self._compaction_thread = None
+        os.makedirs(store_dir, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    # --- manifest ---
+
+    def _empty_manifest(self) -> dict:
+        return {"version": 1, "dim": None, "next_id": 1, "next_chunk_id": 0, "epoch": 0,
+                "base": None, "segments": [], "tombstones_file": None}
+
+    def _read_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return self._empty_manifest()
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _commit_manifest(self, manifest: dict):
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        _atomic_write(self.manifest_path, lambda f: f.write(data))
+        _fsync_dir(self.store_dir)
+        self.manifest = manifest
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store_dir, name)
+
+    def _remove_orphans(self):
+        """Deletes files left behind by writes that never reached the manifest."""
+        live = {MANIFEST_NAME}
+        if self.manifest["base"]:
+            live.update([self.manifest["base"]["index"], self.manifest["base"]["chunks"]])
+            for key in ("vectors", "ids"):
+                if self.manifest["base"].get(key):
+                    live.add(self.manifest["base"][key])
+        for seg in self.manifest["segments"]:
+            live.update([seg["vectors"], seg["chunks"]])
+            if seg.get("ids"):
+                live.add(seg["ids"])
+        if self.manifest.get("tombstones_file"):
+            live.add(self.manifest["tombstones_file"])
+        for name in os.listdir(self.store_dir):
+            if name not in live and not (name.startswith(SIDECAR_PREFIX) and not name.endswith(".tmp")):
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    # --- reading ---
+
+    def load(self) -> Tuple[Optional[Any], ChunkTable]:
+        """Rebuilds the in-memory index and chunk list from the base and all segments."""
+        with self._lock:
+            if not os.path.exists(self.manifest_path) and self._has_legacy_files():
+                self._import_legacy()
+            self._remove_orphans()
+            manifest = self.manifest
+        return self._materialize(manifest)
+
+    def _open_chunks(self, name: str):
+        if name.endswith(".pkl"):
+            # Written before the columnar format; trusted because we wrote it
+            with open(self._path(name), "rb") as f:
+                return InMemoryChunks(pickle.load(f))
+        return ChunkFile(self._path(name))
+
+    def _materialize(self, manifest: dict) -> Tuple[Optional[Any], ChunkTable]:
+        index = None
+        chunks_with_metadata = ChunkTable()
+        if manifest["base"]:
+            index = faiss.read_index(self._path(manifest["base"]["index"]))
+            recorded_type = manifest["base"].get("index_type", "flat")
+            if describe_index(index) != recorded_type:
+                raise ValueError(
+                    f"Base index is {describe_index(index)} but the manifest records {recorded_type}."
+                )
+            chunks_with_metadata.add_part(self._open_chunks(manifest["base"]["chunks"]))
+        for seg in manifest["segments"]:
+            vectors = np.load(self._path(seg["vectors"]))
+            chunks_with_metadata.add_part(self._open_chunks(seg["chunks"]))
+            if index is None:
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+        return index, chunks_with_metadata
+
+    def _has_legacy_files(self) -> bool:
+        return bool(self.legacy_index_path and self.legacy_meta_path
+                    and os.path.exists(self.legacy_index_path)
+                    and os.path.exists(self.legacy_meta_path))
+
+    def _import_legacy(self):
+        """Adopts a pre-segment `faiss_index.bin`/`faiss_chunks.pkl` pair as the base."""
+        index = faiss.read_index(self.legacy_index_path)
+        with open(self.legacy_meta_path, "rb") as f:
+            chunks_with_metadata = pickle.load(f)
+        manifest = self._empty_manifest()
+        manifest["dim"] = index.d
+        manifest["base"] = self._write_base(manifest["next_id"], index, chunks_with_metadata)
+        manifest["next_id"] += 1
+        manifest["next_chunk_id"] = index.ntotal
+        self._commit_manifest(manifest)
+        print(f"[SegmentStore] Imported legacy index with {index.ntotal} vectors.")
+
+    def _vector_table(self, manifest: dict) -> Optional[VectorTable]:
+        if not (manifest["base"] and manifest["base"].get("vectors")):
+            return None
+        table = VectorTable([np.load(self._path(manifest["base"]["vectors"]), mmap_mode="r")])
+        for seg in manifest["segments"]:
+            table.add_part(np.load(self._path(seg["vectors"]), mmap_mode="r"))
+        return table
+
+    def full_vectors(self) -> Optional[VectorTable]:
+        """Memory-mapped full-precision vectors, or None unless the base index is compressed."""
+        with self._lock:
+            return self._vector_table(self.manifest)
+
+    def _chunk_ids(self, manifest: dict) -> np.ndarray:
+        parts = []
+        next_id = 0
+        for entry in ([manifest["base"]] if manifest["base"] else []) + manifest["segments"]:
+            if entry.get("ids"):
+                ids = np.load(self._path(entry["ids"]))
+            else:
+                # Stores written before chunk ids numbered chunks by position
+                first = entry.get("first_chunk_id", next_id)
+                ids = np.arange(first, first + entry["count"], dtype="int64")
+            parts.append(ids)
+            if len(ids):
+                next_id = int(ids[-1]) + 1
+        return np.concatenate(parts) if parts else np.empty(0, dtype="int64")
+
+    def chunk_ids(self) -> np.ndarray:
+        """Stable id of every chunk, by position; ascending."""
+        with self._lock:
+            return self._chunk_ids(self.manifest)
+
+    def tombstones(self) -> np.ndarray:
+        """Ids of chunks that were deleted but are still physically stored."""
+        with self._lock:
+            return self._tombstones(self.manifest)
+
+    def _tombstones(self, manifest: dict) -> np.ndarray:
+        # Manifests written before the tombstone file listed the ids inline
+        parts = [np.asarray(manifest.get("tombstones", []), dtype="int64")]
+        if manifest.get("tombstones_file"):
+            with open(self._path(manifest["tombstones_file"]), "rb") as f:
+                data = f.read()
+            # A torn append leaves a partial id at the end; it was never acknowledged
+            parts.append(np.frombuffer(data[:len(data) - len(data) % 8], dtype="<i8").astype("int64"))
+        return np.unique(np.concatenate(parts))
+
+    def epoch(self) -> int:
+        """Bumped whenever chunk positions are renumbered (i.e. by `write_snapshot`)."""
+        return self.manifest.get("epoch", 0)
+
+    def sidecar_path(self, name: str) -> str:
+        """Path for a derived file kept next to the store; it is not tracked by the manifest."""
+        return self._path(SIDECAR_PREFIX + name)
+
+    # --- writing ---
+
+    def _reserve_id(self) -> int:
+        """Hands out the next file id; callers must hold the lock."""
+        file_id = self.manifest["next_id"]
+        self.manifest["next_id"] += 1
+        return file_id
+
+    def _reserve_chunk_ids(self, manifest: dict, count: int) -> np.ndarray:
+        """Hands out `count` consecutive chunk ids in `manifest`; callers must hold the lock."""
+        first = manifest.get("next_chunk_id")
+        if first is None:
+            ids = self._chunk_ids(manifest)
+            first = int(ids[-1]) + 1 if len(ids) else 0
+        manifest["next_chunk_id"] = first + count
+        return np.arange(first, first + count, dtype="int64")
+
+    def _write_base(self, base_id: int, index, chunks_with_metadata: Iterable[tuple],
+                    vectors: Optional[List[np.ndarray]] = None, ids: Optional[np.ndarray] = None) -> dict:
+        base = {
+            "id": base_id,
+            "index": f"base_{base_id:06d}.faiss",
+            "chunks": f"base_{base_id:06d}.chunks",
+            "count": index.ntotal,
+            "index_type": describe_index(index),
+        }
+        tmp_index = self._path(base["index"] + ".tmp")
+        faiss.write_index(index, tmp_index)
+        with open(tmp_index, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_index, self._path(base["index"]))
+        _atomic_write(self._path(base["chunks"]), lambda f: write_chunk_file(f, chunks_with_metadata))
+        if is_compressed(index):
+            if vectors is None:
+                raise ValueError("A compressed index needs its full-precision vectors.")
+            base["vectors"] = f"base_{base_id:06d}.npy"
+            _write_vectors(self._path(base["vectors"]), vectors)
+        ids = np.arange(index.ntotal, dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+        if len(ids) and int(ids[-1]) - int(ids[0]) + 1 != len(ids):
+            base["ids"] = f"base_{base_id:06d}.ids.npy"
+            _atomic_write(self._path(base["ids"]), lambda f: np.save(f, ids))
+        else:
+            base["first_chunk_id"] = int(ids[0]) if len(ids) else 0
+        return base
+
+    def append(self, embeddings: np.ndarray, chunks_with_metadata: List[tuple]) -> Tuple[ChunkFile, np.ndarray]:
+        """
+        Persists one batch as a new segment; cost is independent of corpus size.
+        Returns the mapped chunks of the new segment and their chunk ids.
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype="float32")
+        if len(vectors) != len(chunks_with_metadata):
+            raise ValueError("Embeddings and chunks must have the same length.")
+        with self._lock:
+            # Reserved in the copy, so a batch that fails to persist uses no ids
+            manifest = json.loads(json.dumps(self.manifest))
+            seg_id = manifest["next_id"]
+            manifest["next_id"] += 1
+            ids = self._reserve_chunk_ids(manifest, len(vectors))
+            seg = {
+                "id": seg_id,
+                "vectors": f"seg_{seg_id:06d}.npy",
+                "chunks": f"seg_{seg_id:06d}.chunks",
+                "count": len(vectors),
+                "first_chunk_id": int(ids[0]) if len(ids) else manifest["next_chunk_id"],
+            }
+            _atomic_write(self._path(seg["vectors"]), lambda f: np.save(f, vectors))
+            _atomic_write(self._path(seg["chunks"]), lambda f: write_chunk_file(f, chunks_with_metadata))
+            manifest["dim"] = manifest["dim"] or int(vectors.shape[1])
+            manifest["segments"].append(seg)
+            self._commit_manifest(manifest)
+            due = self._should_fold(manifest) or self._merge_run(manifest) is not None
+
+        if due:
+            self.compact_in_background()
+        return ChunkFile(self._path(seg["chunks"])), ids
+
+    def _write_tombstones(self, manifest: dict, chunk_ids: np.ndarray):
+        """Starts a new tombstone file holding `chunk_ids` in `manifest`; callers hold the lock."""
+        name = f"tombstones_{manifest['next_id']:06d}.ids"
+        manifest["next_id"] += 1
+        data = np.asarray(chunk_ids, dtype="<i8").tobytes()
+        _atomic_write(self._path(name), lambda f: f.write(data))
+        manifest["tombstones_file"] = name
+        manifest.pop("tombstones", None)
+
+    def add_tombstones(self, chunk_ids: List[int]):
+        """
+        Marks chunks as deleted by id; they are purged by the next snapshot.
+        Appends to the tombstone file, so the cost does not grow with the
+        number of tombstones.
+        """
+        ids = np.asarray(chunk_ids, dtype="<i8")
+        with self._lock:
+            if not self.manifest.get("tombstones_file"):
+                manifest = json.loads(json.dumps(self.manifest))
+                self._write_tombstones(manifest, np.concatenate([self._tombstones(manifest), ids]))
+                self._commit_manifest(manifest)
+                return
+            with open(self._path(self.manifest["tombstones_file"]), "r+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size % 8:
+                    f.truncate(size - size % 8)
+                    f.seek(0, os.SEEK_END)
+                f.write(ids.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    @contextmanager
+    def pinned(self):
+        """
+        Holds off compaction until the block exits, so a `manifest_copy()`
+        taken inside it stays valid for `write_snapshot(..., replaces=copy)`.
+        Appends are not held off: callers take the copy while nothing can be
+        appended, so it lists exactly the rows they copy.
+        """
+        with self._compaction_lock:
+            yield
+
+    def manifest_copy(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self.manifest))
+
+    def write_snapshot(self, index, chunks_with_metadata: Iterable[tuple], ids: np.ndarray,
+                       vectors: Optional[np.ndarray] = None, replaces: Optional[dict] = None) -> ChunkFile:
+        """
+        Replaces the base with the given in-memory state, whose rows have the
+        chunk `ids`. Used when the index itself changes shape (e.g. a flat ->
+        HNSW upgrade) or tombstoned rows are purged. The state must cover every
+        row of `replaces`, a `manifest_copy()` taken inside `pinned()`; segments
+        appended after it are kept. Without `replaces` it must cover every
+        segment. Tombstones of rows that are no longer stored are dropped. A
+        compressed `index` also needs its full-precision `vectors`. Returns the
+        mapped chunks of the new base.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                base_id = self._reserve_id()
+            base = self._write_base(base_id, index, chunks_with_metadata,
+                                    [vectors] if vectors is not None else None, ids)
+            with self._lock:
+                manifest = json.loads(json.dumps(self.manifest))
+                if replaces is not None and (manifest["base"] or {}).get("id") != (replaces["base"] or {}).get("id"):
+                    raise ValueError("The store was compacted after the replaced manifest was pinned.")
+                replaced = {seg["id"] for seg in replaces["segments"]} if replaces is not None else None
+                manifest["dim"] = index.d
+                manifest["base"] = base
+                manifest["segments"] = [seg for seg in manifest["segments"]
+                                        if replaced is not None and seg["id"] not in replaced]
+                self._write_tombstones(manifest, np.intersect1d(self._tombstones(manifest), self._chunk_ids(manifest)))
+                manifest["epoch"] = manifest.get("epoch", 0) + 1
+                self._commit_manifest(manifest)
+                self._remove_orphans()
+        return ChunkFile(self._path(base["chunks"]))
+
+    # --- compaction ---
+
+    def _should_fold(self, manifest: dict) -> bool:
+        """
+        Folding the segments into the base waits until they hold
+        `base_fold_ratio` of the base's rows, so the base is only rewritten
+        after a fixed fraction of its size has been appended.
+        """
+        segments = manifest["segments"]
+        if not self.compaction_threshold or not segments:
+            return False
+        if manifest["base"]:
+            return sum(seg["count"] for seg in segments) >= self.base_fold_ratio * manifest["base"]["count"]
+        return len(segments) >= self.compaction_threshold
+
+    def _merge_run(self, manifest: dict) -> Optional[List[dict]]:
+        """
+        The newest run of `compaction_threshold` segments in which every
+        segment is no larger than the newer ones together, or None. Merging
+        only adjacent segments keeps positions in order, and a row's segment
+        at least doubles in size each time it is merged.
+        """
+        segments = manifest["segments"]
+        if not self.compaction_threshold or not segments:
+            return None
+        run_total = segments[-1]["count"]
+        start = len(segments) - 1
+        while start > 0 and segments[start - 1]["count"] <= run_total:
+            start -= 1
+            run_total += segments[start]["count"]
+        return segments[start:] if len(segments) - start >= self.compaction_threshold else None
+
+    def compact(self):
+        """Merges the base and all current segments into a new base index."""
+        with self._compaction_lock:
+            self._compact()
+
+    def _compact(self):
+        with self._lock:
+            snapshot = json.loads(json.dumps(self.manifest))
+            base_id = self._reserve_id()
+        merged = [seg["id"] for seg in snapshot["segments"]]
+        if not merged:
+            return
+
+        index, chunks_with_metadata = self._materialize(snapshot)
+        vectors = self._vector_table(snapshot)
+        base = self._write_base(base_id, index, chunks_with_metadata, vectors.parts if vectors else None,
+                                self._chunk_ids(snapshot))
+        with self._lock:
+            # Segments appended while we were merging stay in the manifest.
+            manifest = json.loads(json.dumps(self.manifest))
+            manifest["base"] = base
+            manifest["segments"] = [seg for seg in manifest["segments"] if seg["id"] not in merged]
+            self._commit_manifest(manifest)
+            self._remove_orphans()
+        print(f"[SegmentStore] Compacted {len(merged)} segments into base with {index.ntotal} vectors.")
+
+    def _merge_segments(self, snapshot: dict, run: List[dict]):
+        """Rewrites adjacent segments as one; rows keep their positions, so the epoch is unchanged."""
+        with self._lock:
+            seg_id = self._reserve_id()
+        start = (snapshot["base"]["count"] if snapshot["base"] else 0) + sum(
+            seg["count"] for seg in snapshot["segments"][:snapshot["segments"].index(run[0])])
+        count = sum(seg["count"] for seg in run)
+        ids = self._chunk_ids(snapshot)[start:start + count]
+        chunks_with_metadata = ChunkTable()
+        for seg in run:
+            chunks_with_metadata.add_part(self._open_chunks(seg["chunks"]))
+        merged = {
+            "id": seg_id,
+            "vectors": f"seg_{seg_id:06d}.npy",
+            "chunks": f"seg_{seg_id:06d}.chunks",
+            "count": count,
+        }
+        _write_vectors(self._path(merged["vectors"]),
+                       [np.load(self._path(seg["vectors"]), mmap_mode="r") for seg in run])
+        _atomic_write(self._path(merged["chunks"]), lambda f: write_chunk_file(f, chunks_with_metadata))
+        if len(ids) and int(ids[-1]) - int(ids[0]) + 1 != len(ids):
+            # Older stores reserved ids for batches that were never persisted
+            merged["ids"] = f"seg_{seg_id:06d}.ids.npy"
+            _atomic_write(self._path(merged["ids"]), lambda f: np.save(f, ids))
+        else:
+            merged["first_chunk_id"] = int(ids[0]) if len(ids) else run[0].get("first_chunk_id", 0)
+        replaced = {seg["id"] for seg in run}
+        with self._lock:
+            manifest = json.loads(json.dumps(self.manifest))
+            segments = manifest["segments"]
+            at = next(i for i, seg in enumerate(segments) if seg["id"] in replaced)
+            manifest["segments"] = segments[:at] + [merged] + [seg for seg in segments[at:] if seg["id"] not in replaced]
+            self._commit_manifest(manifest)
+            self._remove_orphans()
+        print(f"[SegmentStore] Merged {len(run)} segments into one with {count} vectors.")
+
+    def _compact_step(self) -> bool:
+        """Folds into the base or merges one run of segments; returns False once there is nothing to do."""
+        with self._compaction_lock:
+            with self._lock:
+                snapshot = json.loads(json.dumps(self.manifest))
+            if self._should_fold(snapshot):
+                self._compact()
+                return True
+            run = self._merge_run(snapshot)
+            if run is None:
+                return False
+            self._merge_segments(snapshot, run)
+            return True
+
+    def compact_in_background(self):
+        """Starts a compaction thread unless one is already running."""
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+
+        def run():
+            try:
+                while self._compact_step():
+                    pass
+            except Exception as e:
+                print(f"[SegmentStore] Background compaction failed: {e}")
+
+        self._compaction_thread = threading.Thread(target=run, name="segment-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Blocks until a background compaction, if one is running, has finished."""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)